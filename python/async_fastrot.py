@@ -0,0 +1,267 @@
+"""
+    Description
+    -----------
+    async_fastrot.py provides an asyncio interface to fastrot.py, for use in
+    asynchronous services.
+
+    The CPU-bound model runs in a thread or process pool executor, so that the
+    event loop is not blocked.  With the default (thread pool) executor the
+    model still competes with the event loop for the global interpreter lock;
+    pass a `concurrent.futures.ProcessPoolExecutor` for full isolation.
+
+    Concurrent awaits with identical parameters are coalesced into a single
+    solve, and each caller receives its own copy of the result.  The number of
+    solves submitted to the executor at once may be limited with `max_pending`,
+    which provides backpressure: further calls wait for a free slot.
+    Cancelling a call cancels the solve if no other caller is waiting for it
+    and it has not yet started.
+
+    Example
+    -------
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    import async_fastrot
+
+    async def main():
+        async_fastrot.configure(executor=ProcessPoolExecutor(4), max_pending=8)
+        result = await async_fastrot.run_model_async("H2O", 0.05, 0, 1.5, 90, 181)
+        async for result in async_fastrot.stream_async(
+            "H2O", [(0.05, 0, rh, 90) for rh in (1, 2, 3)], 181
+        ):
+            print(result["Zbar"])
+
+    asyncio.run(main())
+"""
+import copy
+import asyncio
+import weakref
+import functools
+import fastrot
+
+
+class AsyncModel:
+    """Asynchronous fastrot model runs.
+
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor, optional
+        Executor for the model runs, default is the event loop's default
+        executor.
+
+    max_pending : int, optional
+        Maximum number of solves submitted to the executor at once.
+
+    """
+
+    def __init__(self, executor=None, max_pending=None):
+        self.executor = executor
+        self.max_pending = max_pending
+
+        # in-flight solves and semaphores, by event loop
+        self._inflight = weakref.WeakKeyDictionary()
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def _solve(self, loop, func):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            return await loop.run_in_executor(self.executor, func)
+
+        async with semaphore:
+            return await loop.run_in_executor(self.executor, func)
+
+    async def _submit(self, key, func):
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.setdefault(loop, {})
+        if self.max_pending is not None and loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+
+        entry = inflight.get(key)
+        if entry is None:
+            task = loop.create_task(self._solve(loop, func))
+            entry = inflight[key] = [task, 0]
+            task.add_done_callback(lambda t: self._forget(inflight, key, entry))
+
+        task = entry[0]
+        entry[1] += 1  # number of waiters
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1:
+                # new callers must not join the cancelled solve
+                self._forget(inflight, key, entry)
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+        # callers may modify their results
+        return copy.deepcopy(result)
+
+    @staticmethod
+    def _forget(inflight, key, entry):
+        if inflight.get(key) is entry:
+            del inflight[key]
+
+    async def run_model(self, species, Av, Air, rh, obliquity, nlat, temperature0=-1):
+        """Asynchronous `fastrot.run_model`, see that function for details."""
+
+        key = ("run_model", species, Av, Air, rh, obliquity, nlat, temperature0)
+        func = functools.partial(
+            fastrot.run_model,
+            species,
+            Av,
+            Air,
+            rh,
+            obliquity,
+            nlat,
+            temperature0=temperature0,
+            verbosity=0,
+        )
+        return await self._submit(key, func)
+
+    async def run_batch(
+        self,
+        species,
+        Av,
+        Air,
+        rh,
+        obliquity,
+        nlat,
+        temperature0=-1,
+        precision="float64",
+    ):
+        """Asynchronous `fastrot.run_batch`, see that function for details."""
+
+        params = [
+            p if isinstance(p, (int, float)) else tuple(p)
+            for p in (Av, Air, rh, obliquity)
+        ]
+        key = ("run_batch", species, *params, nlat, temperature0, precision)
+        func = functools.partial(
+            fastrot.run_batch,
+            species,
+            *params,
+            nlat,
+            temperature0=temperature0,
+            precision=precision,
+        )
+        return await self._submit(key, func)
+
+    async def stream(self, species, params, nlat, batch_size=100, max_batches=4):
+        """Evaluate a stream of parameter sets.
+
+        Parameters are read from `params` only as fast as the results are
+        consumed, with at most `max_batches` batches evaluated at a time.
+
+
+        Parameters
+        ----------
+        species : str
+            Ice species to consider.
+
+        params : iterable or async iterable
+            (Av, Air, rh, obliquity) tuples.
+
+        nlat : int
+            Number of latitude steps.
+
+        batch_size : int
+            Number of parameter sets per call to `fastrot.run_batch`.
+
+        max_batches : int
+            Maximum number of batches in progress.
+
+
+        Yields
+        ------
+        output : dict
+            The same as the output of `fastrot.run_model`, in the order of
+            `params`.
+
+        """
+
+        async def batches():
+            batch = []
+            if hasattr(params, "__aiter__"):
+                async for p in params:
+                    batch.append(p)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            else:
+                for p in params:
+                    batch.append(p)
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+            if len(batch) > 0:
+                yield batch
+
+        pending = []
+        try:
+            async for batch in batches():
+                task = asyncio.ensure_future(self.run_batch(species, *zip(*batch), nlat))
+                pending.append((batch, task))
+                if len(pending) < max_batches:
+                    continue
+
+                batch, task = pending.pop(0)
+                for output in _outputs(species, batch, await task):
+                    yield output
+
+            while pending:
+                batch, task = pending.pop(0)
+                for output in _outputs(species, batch, await task):
+                    yield output
+        finally:
+            for batch, task in pending:
+                task.cancel()
+
+
+def _outputs(species, batch, zbar):
+    for (Av, Air, rh, obliquity), z in zip(batch, zbar):
+        yield fastrot.output(species, Av, Air, rh, obliquity, z)
+
+
+_default = AsyncModel()
+
+
+def configure(executor=None, max_pending=None):
+    """Set the executor and backpressure limit for the module-level functions."""
+
+    global _default
+    _default = AsyncModel(executor=executor, max_pending=max_pending)
+
+
+async def run_model_async(species, Av, Air, rh, obliquity, nlat, temperature0=-1):
+    """Asynchronous `fastrot.run_model`, see that function for details."""
+
+    return await _default.run_model(
+        species, Av, Air, rh, obliquity, nlat, temperature0=temperature0
+    )
+
+
+async def run_batch_async(
+    species, Av, Air, rh, obliquity, nlat, temperature0=-1, precision="float64"
+):
+    """Asynchronous `fastrot.run_batch`, see that function for details."""
+
+    return await _default.run_batch(
+        species,
+        Av,
+        Air,
+        rh,
+        obliquity,
+        nlat,
+        temperature0=temperature0,
+        precision=precision,
+    )
+
+
+def stream_async(species, params, nlat, batch_size=100, max_batches=4):
+    """Evaluate a stream of parameter sets, see `AsyncModel.stream`."""
+
+    return _default.stream(
+        species, params, nlat, batch_size=batch_size, max_batches=max_batches
+    )
@@ -0,0 +1,409 @@
+"""
+    Description
+    -----------
+    benchmark_fastrot.py compares the speed and accuracy of the fastrot
+    implementations (engines) over a shared parameter grid:
+        - run_model: fastrot.run_model, called once per grid point
+        - run_batch: fastrot.run_batch, called once per species
+        - run_batch_float32: as run_batch, with single-precision results
+        - fortran: cgifastrot.f and sublime.f, compiled with gfortran (if
+          available) and called once per grid point
+
+    The number of latitude steps of the FORTRAN code is fixed at compile time,
+    so a copy of the code is compiled for each requested nlat.  Note that the
+    FORTRAN code runs in single precision and prints Zbar to four significant
+    digits, so its relative error cannot be measured below ~1e-3.
+
+    The FORTRAN code is run in a new process for each grid point, and the
+    process launch takes as long as, or longer than, the calculation.  The
+    launch overhead is measured by running the executable without arguments,
+    which exits immediately, and subtracted to estimate the throughput of the
+    solver itself.
+
+    For each engine and nlat the report gives the throughput (grid points per
+    second, including process launch), the solver throughput (excluding
+    process launch), and the median and maximum per-point relative error in
+    Zbar with respect to fastrot.run_batch at a large number of latitude steps
+    (`nlat_ref`).  Read down a column to follow the convergence with nlat.
+    Errors of failed points are `None` in the saved report.
+
+
+    Parameters
+    ----------
+    species : str
+        Ice species to consider: 'H2O', 'H2O-CH4', 'CO2', 'CO'
+    Av : float
+        Visual albedo
+    Air : float
+        Infrared albedo
+    rh : float
+        Heliocentric distance (in au)
+    obliquity : float
+        Obliquity - 90 - angle between rotation axis and the solar direction
+    nlat : int
+        Number of latitude steps
+
+
+    Returns
+    -------
+    report : dict
+        report["engines"][engine][nlat] is a dictionary with the keys:
+            - "throughput" : float
+            - "launch_overhead" : float, seconds per grid point
+            - "solver_throughput" : float
+            - "median_error" : float
+            - "max_error" : float
+            - "failures" : int
+            - "errors" : list of float
+"""
+import os
+import re
+import json
+import math
+import time
+import shutil
+import tempfile
+import subprocess
+from itertools import product
+import fastrot
+
+fortran_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fortran")
+
+species_index = {"H2O": 1, "H2O-CH4": 2, "CO2": 3, "CO": 4}
+
+
+def run_model_engine(species, Av, Air, rh, obliquity, nlat):
+    return [
+        fastrot.run_model(species, *inputs, nlat, verbosity=0)["Zbar"]
+        for inputs in zip(Av, Air, rh, obliquity)
+    ]
+
+
+def run_batch_engine(species, Av, Air, rh, obliquity, nlat):
+    return list(fastrot.run_batch(species, Av, Air, rh, obliquity, nlat))
+
+
+def run_batch_float32_engine(species, Av, Air, rh, obliquity, nlat):
+    return list(
+        fastrot.run_batch(species, Av, Air, rh, obliquity, nlat, precision="float32")
+    )
+
+
+engines = {
+    "run_model": run_model_engine,
+    "run_batch": run_batch_engine,
+    "run_batch_float32": run_batch_float32_engine,
+}
+
+
+def build_fortran(nlat, build_dir):
+    """Compile cgifastrot.f with `nlat` latitude steps.
+
+
+    Returns
+    -------
+    executable : str or None
+        Path to the executable, or `None` if gfortran is not available.
+
+    """
+
+    gfortran = shutil.which("gfortran")
+    if gfortran is None:
+        return None
+
+    with open(os.path.join(fortran_dir, "cgifastrot.f")) as inf:
+        source = inf.read()
+
+    source, n = re.subn(r"\(41\)", f"({nlat})", source)
+    source, m = re.subn(r"nb/41/", f"nb/{nlat}/", source)
+    if n != 4 or m != 1:
+        raise RuntimeError("Unable to set the number of latitude steps in cgifastrot.f")
+
+    path = os.path.join(build_dir, f"cgifastrot_{nlat}.f")
+    with open(path, "w") as outf:
+        outf.write(source)
+
+    executable = os.path.join(build_dir, f"fastrot_{nlat}")
+    subprocess.run(
+        [
+            gfortran,
+            "-O2",
+            "-w",
+            path,
+            os.path.join(fortran_dir, "sublime.f"),
+            "-o",
+            executable,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return executable
+
+
+def fortran_engine(build_dir):
+    """FORTRAN engine, compiling executables into `build_dir` as needed."""
+
+    executables = {}
+
+    def engine(species, Av, Air, rh, obliquity, nlat):
+        if nlat not in executables:
+            executables[nlat] = build_fortran(nlat, build_dir)
+
+        zbar = []
+        for inputs in zip(Av, Air, rh, obliquity):
+            # parameters are read into nine-character strings
+            args = [f"{x:.6g}" for x in inputs]
+            output = subprocess.run(
+                [executables[nlat], str(species_index[species])] + args,
+                capture_output=True,
+                text=True,
+            ).stdout.splitlines()
+
+            try:
+                zbar.append(float(output[-1].split()[-2]))
+            except (IndexError, ValueError):
+                zbar.append(math.nan)
+
+        return zbar
+
+    engine.executables = executables
+    return engine
+
+
+def launch_overhead(executable, repeat=21):
+    """Median time to start and exit `executable`, without a calculation."""
+
+    # without arguments the program fails to read its parameters and exits,
+    # skip the (slow) error backtrace
+    env = dict(os.environ, GFORTRAN_ERROR_BACKTRACE="0")
+
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([executable], capture_output=True, env=env)
+        times.append(time.perf_counter() - t0)
+
+    return sorted(times)[repeat // 2]
+
+
+def relative_error(z, z_ref):
+    if z_ref == 0 or math.isnan(z):
+        return math.nan
+    return abs(z - z_ref) / z_ref
+
+
+def benchmark(
+    species_set,
+    Av_set,
+    Air_set,
+    rh_set,
+    obl_set,
+    nlat_set,
+    engine_set=None,
+    nlat_ref=2001,
+):
+    """Benchmark the engines over a parameter grid.
+
+
+    Parameters
+    ----------
+    species_set, Av_set, Air_set, rh_set, obl_set : list
+        Parameter grid, see `survey_fastrot`.
+
+    nlat_set : list of int
+        Numbers of latitude steps to test.
+
+    engine_set : list of str, optional
+        Engines to test, default is all of `engines` and, if gfortran is
+        available, "fortran".
+
+    nlat_ref : int
+        Number of latitude steps for the reference values.
+
+
+    Returns
+    -------
+    report : dict
+
+    """
+
+    build_dir = tempfile.mkdtemp(prefix="fastrot")
+    try:
+        available = dict(engines)
+        if shutil.which("gfortran") is not None:
+            available["fortran"] = fortran_engine(build_dir)
+
+        if engine_set is None:
+            engine_set = list(available)
+        for name in engine_set:
+            if name not in available:
+                raise ValueError(f"Engine {name} is not available.")
+
+        # grid points by species
+        grid = {
+            species: list(zip(*product(Av_set, Air_set, rh_set, obl_set)))
+            for species in species_set
+        }
+        npoints = len(species_set) * len(grid[species_set[0]][0])
+
+        reference = []
+        for species, params in grid.items():
+            reference.extend(fastrot.run_batch(species, *params, nlat_ref))
+
+        report = {
+            "points": [
+                [species] + list(p) for species in grid for p in zip(*grid[species])
+            ],
+            "nlat_ref": nlat_ref,
+            "reference": reference,
+            "engines": {},
+        }
+
+        for name in engine_set:
+            report["engines"][name] = {}
+            for nlat in nlat_set:
+                engine = available[name]
+                if name == "fortran":
+                    # exclude compilation time
+                    engine(species_set[0], [0.05], [0], [1], [90], nlat)
+
+                zbar = []
+                t0 = time.perf_counter()
+                for species, params in grid.items():
+                    zbar.extend(engine(species, *params, nlat))
+                dt = time.perf_counter() - t0
+
+                overhead = 0.0
+                if name == "fortran":
+                    overhead = launch_overhead(engine.executables[nlat])
+                solver_dt = dt - npoints * overhead
+
+                errors = [relative_error(z, z_ref) for z, z_ref in zip(zbar, reference)]
+                finite = sorted(e for e in errors if not math.isnan(e))
+                report["engines"][name][nlat] = {
+                    "throughput": npoints / dt,
+                    "launch_overhead": overhead,
+                    # below the timing precision if the overhead is larger
+                    "solver_throughput": npoints / solver_dt if solver_dt > 0 else math.nan,
+                    "median_error": finite[len(finite) // 2] if finite else math.nan,
+                    "max_error": finite[-1] if finite else math.nan,
+                    "failures": len(errors) - len(finite),
+                    "errors": errors,
+                }
+    finally:
+        shutil.rmtree(build_dir)
+
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"{len(report['points'])} grid points,"
+        f" errors relative to run_batch with nlat={report['nlat_ref']}",
+        "",
+        f"{'engine':<18} {'nlat':>6} {'points/s':>10} {'solver/s':>10}"
+        f" {'median err':>11} {'max err':>10} {'failures':>8}",
+    ]
+    for name, results in report["engines"].items():
+        for nlat, r in results.items():
+            lines.append(
+                f"{name:<18} {nlat:>6} {r['throughput']:>10.1f}"
+                f" {r['solver_throughput']:>10.1f} {r['median_error']:>11.3e} {r['max_error']:>10.3e}"
+                f" {r['failures']:>8}"
+            )
+    lines.extend(
+        [
+            "",
+            "points/s includes process launch, solver/s excludes it (FORTRAN only)",
+        ]
+    )
+    return "\n".join(lines)
+
+
+def to_json(x):
+    """Replace NaN with `None`, for standard JSON."""
+
+    if isinstance(x, float) and math.isnan(x):
+        return None
+    if isinstance(x, dict):
+        return {k: to_json(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [to_json(v) for v in x]
+    return x
+
+
+description = (
+    "Use this program to compare the speed and accuracy of the fastrot engines,"
+    " including the FORTRAN code if gfortran is available."
+)
+
+if __name__ == "__main__":
+    import argparse
+
+    speciesList = ["H2O", "H2O-CH4", "CO2", "CO"]
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--species_set",
+        metavar="species",
+        choices=speciesList,
+        nargs="+",
+        default=["H2O", "CO2", "CO"],
+        help="Ice species to consider.",
+    )
+    parser.add_argument(
+        "--Av_set", nargs="+", metavar="visual_albedo", type=float, default=[0.05]
+    )
+    parser.add_argument(
+        "--Air_set", nargs="+", metavar="infrared_albedo", type=float, default=[0.0]
+    )
+    parser.add_argument(
+        "--rh_set",
+        nargs="+",
+        metavar="heliocentric_distance",
+        type=float,
+        default=[0.5, 1.0, 2.0, 4.0, 8.0],
+    )
+    parser.add_argument(
+        "--obl_set", nargs="+", metavar="obliquity", type=float, default=[0, 45, 90]
+    )
+    parser.add_argument(
+        "--nlat_set",
+        nargs="+",
+        metavar="n",
+        type=int,
+        default=[21, 41, 81, 181],
+        help="Numbers of latitude steps",
+    )
+    parser.add_argument(
+        "--nlat_ref",
+        metavar="n",
+        type=int,
+        default=2001,
+        help="Number of latitude steps for the reference values",
+    )
+    parser.add_argument(
+        "--engines", nargs="+", metavar="engine", help="Engines to test (default: all)"
+    )
+    parser.add_argument(
+        "-o", metavar="filename", dest="filename", help="Save the report to this file name"
+    )
+
+    args = parser.parse_args()
+    report = benchmark(
+        args.species_set,
+        args.Av_set,
+        args.Air_set,
+        args.rh_set,
+        args.obl_set,
+        args.nlat_set,
+        engine_set=args.engines,
+        nlat_ref=args.nlat_ref,
+    )
+    print(format_report(report))
+
+    if args.filename is not None:
+        with open(args.filename, "w") as json_file:
+            json.dump(to_json(report), json_file, allow_nan=False)
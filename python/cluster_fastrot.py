@@ -0,0 +1,549 @@
+"""
+    Description
+    -----------
+    cluster_fastrot.py distributes a survey (see survey_fastrot.py) over many
+    processes or machines.
+
+    A coordinator tiles the parameter space into chunks (tasks) and serves them
+    over TCP.  Workers connect to the coordinator, pull a task, evaluate it
+    with `fastrot.run_batch`, and push the results back.  The coordinator
+    writes the results into a memory-mapped grid file, the same as
+    `survey_fastrot.survey_memmap`, which may be opened with
+    `survey_fastrot.load_memmap`.
+
+    Each task is leased to a worker for `timeout` seconds.  Tasks from workers
+    that fail or do not respond within that time are handed out again, up to
+    `max_attempts` times.  Late results for a task that was already completed
+    are ignored.  If all of the local workers exit before the survey is done,
+    and no remote workers are expected, the survey fails rather than waiting.
+
+    Messages are single lines of JSON, one request and one reply per
+    connection:
+        - {"request": "task"} -> {"task": id, "species": ..., "params": ...,
+          "nlat": ..., "precision": ...}, {"wait": seconds}, or {"done": true}
+        - {"result": id, "zbar": [...]} -> {"ok": true, "done": ...}, or
+          {"ok": false, ...} for an unknown task, with "done" true once the
+          survey is finished
+        - {"error": id, "message": ...} -> {"ok": true}
+
+    There is no authentication, so only run the coordinator on a trusted
+    network.  By default it listens on the loopback interface.
+
+
+    Parameters
+    ----------
+    species_set, Av_set, Air_set, rh_set, obl_set : list or value
+        Parameter values, see survey_fastrot.py
+    nlat : int
+        Number of latitude steps
+    path : str
+        Grid file name
+
+
+    Returns
+    -------
+    metadata : dict
+        Grid file metadata, see `survey_fastrot.create_memmap`
+"""
+import json
+import time
+import array
+import socket
+import logging
+import threading
+import socketserver
+import multiprocessing
+from collections import deque
+import fastrot
+import survey_fastrot
+
+
+class Coordinator:
+    """Task bookkeeping for a distributed survey.
+
+
+    Parameters
+    ----------
+    axes : dict
+        Parameter grid axes, see `survey_fastrot.make_axes`.
+
+    nlat : int
+        Number of latitude steps.
+
+    grid : memoryview
+        Flat view of the grid file to fill.
+
+    chunk_size : int
+        Number of grid points per task.
+
+    precision : str
+        "float64" or "float32".
+
+    timeout : float
+        Task lease time, seconds.
+
+    max_attempts : int
+        Maximum number of times a task is handed out.
+
+    """
+
+    def __init__(self, axes, nlat, grid, chunk_size, precision, timeout, max_attempts):
+        self.nlat = nlat
+        self.grid = grid
+        self.precision = precision
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+        n = len(grid) // len(axes["species"])
+        self.ntasks = len(axes["species"]) * -(-n // chunk_size)
+        self.tasks = enumerate(survey_fastrot.chunks(axes, chunk_size))
+        self.retry = deque()  # (task id, attempts, task)
+        self.leases = {}  # task id: (deadline, attempts, task)
+        self.completed = set()
+        self.error = None
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def expire(self):
+        """Hand out the tasks with expired leases again."""
+
+        with self.lock:
+            self._expire()
+
+    def _expire(self):
+        now = time.monotonic()
+        for task_id, (deadline, attempts, task) in list(self.leases.items()):
+            if deadline < now:
+                logging.warning("Task %d lease expired.", task_id)
+                del self.leases[task_id]
+                self._retry(task_id, attempts, task)
+
+    def _retry(self, task_id, attempts, task):
+        if attempts >= self.max_attempts:
+            self.error = f"Task {task_id} failed after {attempts} attempts."
+            self.finished.set()
+        else:
+            self.retry.append((task_id, attempts, task))
+
+    def next_task(self):
+        """Lease the next task.
+
+
+        Returns
+        -------
+        reply : dict
+            Message for the worker.
+
+        """
+
+        with self.lock:
+            if self.finished.is_set():
+                return {"done": True}
+
+            self._expire()
+
+            while self.retry and self.retry[0][0] in self.completed:
+                self.retry.popleft()
+
+            if self.retry:
+                task_id, attempts, task = self.retry.popleft()
+            else:
+                try:
+                    task_id, task = next(self.tasks)
+                    attempts = 0
+                except StopIteration:
+                    return {"wait": min(1.0, self.timeout)}
+
+            self.leases[task_id] = (time.monotonic() + self.timeout, attempts + 1, task)
+            species, offset, params = task
+            return {
+                "task": task_id,
+                "species": species,
+                "params": params,
+                "nlat": self.nlat,
+                "precision": self.precision,
+            }
+
+    def complete(self, task_id, zbar):
+        """Save the results of a task.
+
+
+        Returns
+        -------
+        ok : bool
+            `False` if the task is unknown.
+
+        """
+
+        with self.lock:
+            if task_id in self.completed or self.finished.is_set():
+                return True
+
+            if task_id in self.leases:
+                task = self.leases.pop(task_id)[2]
+            else:
+                # a late result for a task waiting to be retried
+                task = next((t[2] for t in self.retry if t[0] == task_id), None)
+                if task is None:
+                    logging.warning("Ignoring the result of unknown task %s.", task_id)
+                    return False
+
+            offset = task[1]
+            self.grid[offset : offset + len(zbar)] = array.array(self.grid.format, zbar)
+            self.completed.add(task_id)
+            if len(self.completed) == self.ntasks:
+                self.finished.set()
+            return True
+
+    def fail(self, task_id, message):
+        """Record a failed task."""
+
+        with self.lock:
+            logging.warning("Task %d failed: %s", task_id, message)
+            if task_id in self.leases:
+                deadline, attempts, task = self.leases.pop(task_id)
+                self._retry(task_id, attempts, task)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        message = json.loads(self.rfile.readline())
+
+        if "request" in message:
+            reply = coordinator.next_task()
+        elif "result" in message:
+            ok = coordinator.complete(message["result"], message["zbar"])
+            reply = {"ok": ok, "done": coordinator.finished.is_set()}
+        elif "error" in message:
+            coordinator.fail(message["error"], message["message"])
+            reply = {"ok": True}
+        else:
+            reply = {"error": "Invalid request."}
+
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def send(host, port, message, timeout=60):
+    """Send a message to the coordinator and return the reply."""
+
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def request(host, port, message, grace):
+    """Send a message to the coordinator, retrying on errors.
+
+    Connection errors and empty or invalid replies, e.g., when the coordinator
+    fails to handle the message, are retried with exponential backoff.
+
+
+    Parameters
+    ----------
+    host, port : str, int
+        Coordinator address.
+
+    message : dict
+
+    grace : float
+        Give up after this many seconds.
+
+
+    Returns
+    -------
+    reply : dict or None
+        `None` if the coordinator could not be reached.
+
+    """
+
+    deadline = time.monotonic() + grace
+    delay = 0.5
+    while True:
+        try:
+            return send(host, port, message)
+        except (OSError, ValueError) as e:
+            if time.monotonic() + delay > deadline:
+                logging.warning("Giving up on the coordinator: %s", e)
+                return None
+            logging.info("Retrying in %.1f s: %s", delay, e)
+            time.sleep(delay)
+            delay = min(2 * delay, 8.0)
+
+
+def worker(host, port, connect_timeout=30):
+    """Evaluate tasks from a coordinator until the survey is done.
+
+
+    Parameters
+    ----------
+    host, port : str, int
+        Coordinator address.
+
+    connect_timeout : float
+        Keep trying to reach the coordinator for this many seconds, at start
+        up or after a network error.  The worker exits after that, e.g., when
+        the coordinator has shut down.
+
+
+    Returns
+    -------
+    ntasks : int
+        Number of tasks completed by this worker.
+
+    """
+
+    ntasks = 0
+    while True:
+        reply = request(host, port, {"request": "task"}, connect_timeout)
+        if reply is None or reply.get("done"):
+            return ntasks
+
+        if "wait" in reply:
+            time.sleep(reply["wait"])
+            continue
+
+        try:
+            zbar = fastrot.run_batch(
+                reply["species"],
+                *reply["params"],
+                reply["nlat"],
+                precision=reply["precision"],
+            )
+            message = {"result": reply["task"], "zbar": list(zbar)}
+        except Exception as e:
+            message = {"error": reply["task"], "message": str(e)}
+
+        reply = request(host, port, message, connect_timeout)
+        if reply is None:
+            return ntasks
+        ntasks += 1
+        if reply.get("done"):
+            return ntasks
+
+
+def coordinate(
+    species_set,
+    Av_set,
+    Air_set,
+    rh_set,
+    obl_set,
+    nlat,
+    path,
+    host="127.0.0.1",
+    port=0,
+    chunk_size=1000,
+    precision="float64",
+    timeout=600,
+    max_attempts=3,
+    workers=0,
+    remote=None,
+):
+    """Run a survey with remote workers.
+
+
+    Parameters
+    ----------
+    species_set, Av_set, Air_set, rh_set, obl_set : list or value
+        Parameter values.
+
+    nlat : int
+        Number of latitude steps.
+
+    path : str
+        Grid file name, see `survey_fastrot.create_memmap`.
+
+    host, port : str, int
+        Address to listen on.  With port 0, a free port is chosen.
+
+    chunk_size : int
+        Number of grid points per task.
+
+    precision : str
+        "float64" or "float32".
+
+    timeout : float
+        Seconds before a task is handed out to another worker.
+
+    max_attempts : int
+        Maximum number of times a task is handed out.
+
+    workers : int
+        Number of local worker processes to start.
+
+    remote : bool, optional
+        Whether remote workers are expected.  If not, the survey fails when
+        all of the local workers have exited.  Default is `True` without local
+        workers, otherwise `False`.
+
+
+    Returns
+    -------
+    metadata : dict
+
+    """
+
+    if remote is None:
+        remote = workers == 0
+    if not remote and workers == 0:
+        raise ValueError("Local workers are required when remote workers are not expected.")
+
+    axes = survey_fastrot.make_axes(species_set, Av_set, Air_set, rh_set, obl_set)
+    mm, metadata = survey_fastrot.create_memmap(path, axes, nlat, precision)
+    grid = memoryview(mm).cast(fastrot.precisions[precision])
+    coordinator = Coordinator(
+        axes, nlat, grid, chunk_size, precision, timeout, max_attempts
+    )
+
+    server = Server((host, port), RequestHandler)
+    server.coordinator = coordinator
+    host, port = server.server_address[:2]
+    logging.info("Coordinator listening on %s:%d, %d tasks", host, port, coordinator.ntasks)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    processes = [
+        multiprocessing.Process(target=worker, args=(host, port)) for i in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+
+        # expire leases even when no worker is asking for tasks, and watch for
+        # the local workers
+        poll = min(1.0, timeout)
+        while not coordinator.finished.wait(poll):
+            coordinator.expire()
+            if not remote and not any(process.is_alive() for process in processes):
+                raise RuntimeError(
+                    "All local workers exited before the survey was finished."
+                )
+
+        # local workers exit after they are told the survey is done
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        server.shutdown()
+        server.server_close()
+
+        mm.flush()
+        grid.release()
+        mm.close()
+
+    if coordinator.error is not None:
+        raise RuntimeError(coordinator.error)
+
+    return metadata
+
+
+description = (
+    "Use this program to distribute `survey_fastrot.py` over many processes or machines.\n\n"
+    "Start a coordinator:\n"
+    "  cluster_fastrot.py coordinator --species_set H2O --Av_set 0.05 --Air_set 0\n"
+    "      --rh_set 1 2 3 --obl_set 0 45 90 --memmap grid.bin --host 0.0.0.0 --port 5000\n\n"
+    "Then start workers, on this or other machines:\n"
+    "  cluster_fastrot.py worker --host coordinator.address --port 5000"
+)
+
+if __name__ == "__main__":
+    import argparse
+
+    speciesList = ["H2O", "H2O-CH4", "CO2", "CO"]
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="serve tasks")
+    coordinator_parser.add_argument(
+        "--species_set",
+        metavar="species",
+        choices=speciesList,
+        nargs="+",
+        required=True,
+        help="Ice species to consider.",
+    )
+    for name, metavar in [
+        ("--Av_set", "visual_albedo"),
+        ("--Air_set", "infrared_albedo"),
+        ("--rh_set", "heliocentric_distance"),
+        ("--obl_set", "obliquity"),
+    ]:
+        coordinator_parser.add_argument(
+            name, nargs="+", metavar=metavar, type=float, required=True
+        )
+    coordinator_parser.add_argument(
+        "--nlat", metavar="n", type=int, default=181, help="Number of latitude steps"
+    )
+    coordinator_parser.add_argument(
+        "--memmap", metavar="filename", required=True, help="Grid file name"
+    )
+    coordinator_parser.add_argument(
+        "--chunk", metavar="n", type=int, default=1000, help="Grid points per task"
+    )
+    coordinator_parser.add_argument(
+        "--precision",
+        choices=list(fastrot.precisions),
+        default="float64",
+        help="Grid file precision",
+    )
+    coordinator_parser.add_argument(
+        "--timeout",
+        metavar="seconds",
+        type=float,
+        default=600,
+        help="Hand out a task again if a worker has not returned it by this time",
+    )
+    coordinator_parser.add_argument(
+        "--workers",
+        metavar="n",
+        type=int,
+        default=0,
+        help="Number of local worker processes to start",
+    )
+    coordinator_parser.add_argument(
+        "--remote",
+        action="store_true",
+        help="Wait for remote workers after the local workers have exited",
+    )
+
+    worker_parser = subparsers.add_parser("worker", help="evaluate tasks")
+
+    for p in [coordinator_parser, worker_parser]:
+        p.add_argument("--host", default="127.0.0.1", help="Coordinator address")
+        p.add_argument("--port", type=int, default=5000, help="Coordinator port")
+
+    args = parser.parse_args()
+    logging.basicConfig(level="INFO")
+
+    if args.mode == "coordinator":
+        coordinate(
+            args.species_set,
+            args.Av_set,
+            args.Air_set,
+            args.rh_set,
+            args.obl_set,
+            args.nlat,
+            args.memmap,
+            host=args.host,
+            port=args.port,
+            chunk_size=args.chunk,
+            precision=args.precision,
+            timeout=args.timeout,
+            workers=args.workers,
+            remote=args.remote or args.workers == 0,
+        )
+    else:
+        ntasks = worker(args.host, args.port)
+        logging.info("Worker completed %d tasks", ntasks)
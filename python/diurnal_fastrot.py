@@ -0,0 +1,567 @@
+"""
+Description
+-----------
+This program calculates the average sublimation per unit area for a rotating
+cometary nucleus with a finite thermal inertia.  fastrot.py covers the limit of
+infinite thermal inertia, where a parallel of latitude is an isotherm, and its
+pole-on case the limit of zero thermal inertia.  Here, one-dimensional heat
+conduction into the subsurface is solved over the rotation period at each
+latitude, with the energy balance of fastrot.py (including sublimation) as the
+surface boundary condition.
+
+Depth is measured in units of the diurnal skin depth, sqrt(k / (rho c omega)),
+and time in units of 1 / omega, where omega = 2 pi / period.  The solution then
+depends on the thermal properties only through the thermal inertia,
+sqrt(k rho c).  The subsurface is divided into layers of geometrically
+increasing thickness, to a depth of several skin depths, with no heat flow
+through the bottom.
+
+The heat equation is integrated with the implicit (backward Euler) method.  The
+coefficients of the tridiagonal system do not depend on the latitude or time
+step, so the elimination is precomputed once, leaving a single nonlinear
+equation for the surface temperature at each step, which is solved with a
+secant method safeguarded by bisection.  The insolation is averaged over each
+time step, so that its diurnal mean is exactly that of fastrot.py.
+
+Each latitude starts from the isothermal solution of fastrot.py and is
+integrated over whole rotations until the diurnal mean sublimation (to 1e-4,
+relative) and surface temperature (to 0.01 K) repeat from one rotation to the
+next, first with a coarse time step (spin_up_nt per rotation), then with the
+full time step.  After each rotation, the subsurface temperatures are shifted
+to cancel the diurnal mean energy imbalance at the surface, which speeds up
+the slow relaxation of the deeper layers.
+
+With the default 96 time steps per rotation and 16 layers, a model with 41
+latitude steps takes roughly 0.2 to 1 s, several hundred times longer than
+fastrot.py.  For many parameter sets, use `run_batch`, or
+survey_fastrot.survey_memmap with a thermal inertia and rotation period.
+"""
+
+import math
+import json
+import array
+import logging
+import fastrot
+
+# time steps per rotation for the initial, coarse integration
+spin_up_nt = 24
+
+# highest temperatures accepted by fastrot.sublime
+temperature_limit = {"CO": 68.127}
+
+
+def depth_grid(nz, dz0, growth):
+    """Depths of the subsurface layers.
+
+
+    Parameters
+    ----------
+    nz : int
+        Number of layers, including the surface.
+
+    dz0 : float
+        Thickness of the top layer (skin depths).
+
+    growth : float
+        Ratio of the thicknesses of successive layers.
+
+
+    Returns
+    -------
+    depths : list of float
+        Depth of each layer (skin depths), starting with 0 at the surface.
+
+    """
+
+    depths = [0.0]
+    dz = dz0
+    for j in range(1, nz):
+        depths.append(depths[-1] + dz)
+        dz *= growth
+    return depths
+
+
+def elimination(depths, dtau):
+    """Precompute the elimination of the implicit heat equation.
+
+    The temperatures at the new time step satisfy
+        T[j] = alpha[j] * T[j - 1] + beta[j],
+    for j > 0, where
+        beta[nz - 1] = gain[nz - 1] * T_old[nz - 1]
+        beta[j] = gain[j] * T_old[j] + carry[j] * beta[j + 1].
+
+
+    Parameters
+    ----------
+    depths : list of float
+        Layer depths (skin depths).
+
+    dtau : float
+        Time step (1 / omega).
+
+
+    Returns
+    -------
+    alpha, gain, carry : list of float
+
+    capacity : float
+        Heat capacity of the surface layer divided by the time step,
+        dimensionless.
+
+    """
+
+    nz = len(depths)
+    h = [None] + [depths[j] - depths[j - 1] for j in range(1, nz)]
+
+    alpha = [0.0] * nz
+    gain = [0.0] * nz
+    carry = [0.0] * nz
+
+    # bottom layer: no heat flow through the bottom
+    s = h[nz - 1] / 2 / dtau
+    d = s + 1 / h[nz - 1]
+    alpha[nz - 1] = 1 / h[nz - 1] / d
+    gain[nz - 1] = s / d
+
+    for j in range(nz - 2, 0, -1):
+        s = (h[j] + h[j + 1]) / 2 / dtau
+        d = s + 1 / h[j] + 1 / h[j + 1] * (1 - alpha[j + 1])
+        alpha[j] = 1 / h[j] / d
+        gain[j] = s / d
+        carry[j] = 1 / h[j + 1] / d
+
+    capacity = h[1] / 2 / dtau
+    return alpha, gain, carry, capacity
+
+
+def step_insolation(sin_latitude, obliquity, nt):
+    """Insolation scale factor averaged over each time step of a rotation.
+
+    The average of the steps is the rotationally averaged insolation scale
+    factor of `fastrot.insolation`.
+
+
+    Parameters
+    ----------
+    sin_latitude : float
+        sin(latitude).
+
+    obliquity : float
+        See `fastrot.run_model`.
+
+    nt : int
+        Number of time steps per rotation.
+
+
+    Returns
+    -------
+    fracs : list of float
+        Mean value of cos(theta) over each time step, starting at midnight.
+
+    """
+
+    # cos(theta) = A + B cos(hour angle), > 0 for |hour angle| < h0
+    A = sin_latitude * math.sin(math.radians(obliquity))
+    B = math.sqrt(1 - sin_latitude**2) * math.cos(math.radians(obliquity))
+    if A + B <= 0:
+        return [0.0] * nt
+    elif A - B >= 0:
+        h0 = math.pi
+    else:
+        h0 = math.acos(-A / B)
+
+    dh = 2 * math.pi / nt
+    fracs = []
+    for k in range(nt):
+        lower = max(-math.pi + k * dh, -h0)
+        upper = min(-math.pi + (k + 1) * dh, h0)
+        if upper > lower:
+            fracs.append(
+                (A * (upper - lower) + B * (math.sin(upper) - math.sin(lower))) / dh
+            )
+        else:
+            fracs.append(0.0)
+
+    return fracs
+
+
+def periodic(species, Air, insolation, temperatures, depths, conductance, max_rotations):
+    """Integrate one latitude over whole rotations until the solution repeats.
+
+
+    Parameters
+    ----------
+    species, Air : see `fastrot.run_model`
+
+    insolation : list of float
+        Absorbed solar flux at each time step (erg cm^-2 s^-1).  The number of
+        time steps per rotation is the length of the list.
+
+    temperatures : list of float
+        Layer temperatures at the start, updated in place.
+
+    depths : list of float
+        Layer depths (skin depths).
+
+    conductance : float
+        Thermal inertia in cgs units times sqrt(omega).
+
+    max_rotations : int
+        Maximum number of rotations.
+
+
+    Returns
+    -------
+    z : float
+        Diurnal mean sublimation rate.
+
+    temperature : float
+        Diurnal mean surface temperature.
+
+    rotations : int
+        Number of rotations calculated.
+
+    """
+
+    nt = len(insolation)
+    nz = len(depths)
+    alpha, gain, carry, capacity = elimination(depths, 2 * math.pi / nt)
+    h1 = depths[1]
+    a = conductance * (capacity + (1 - alpha[1]) / h1)
+    sun_sum = sum(insolation)
+    t_limit = temperature_limit.get(species, math.inf)
+    surface_loss = fastrot.surface_loss
+
+    T = temperatures
+    beta = [0.0] * nz
+    z = temperature = math.nan
+    t_previous = T[0]
+    for rotation in range(1, max_rotations + 1):
+        zsum = tsum = loss_sum = dloss_sum = 0.0
+        for sun in insolation:
+            b = gain[nz - 1] * T[nz - 1]
+            beta[nz - 1] = b
+            for j in range(nz - 2, 0, -1):
+                b = gain[j] * T[j] + carry[j] * b
+                beta[j] = b
+
+            # surface energy balance
+            rhs = conductance * (capacity * T[0] + beta[1] / h1) + sun
+            t = 2 * T[0] - t_previous  # extrapolate from the previous steps
+            t_previous = T[0]
+            lower, upper = 0.0, t_limit
+            t = min(t, t_limit)
+            t_last = None
+            for niter in range(100):
+                loss, dloss, zk, t = surface_loss(species, Air, t)
+                phi = a * t + loss - rhs
+                width = upper - lower
+                if phi > 0:
+                    upper = t
+                else:
+                    lower = t
+
+                # dloss omits the ln(10) factor of the vapor pressure
+                # derivative, so use secant steps after the first
+                if t_last is not None and t != t_last:
+                    dloss = (loss - loss_last) / (t - t_last)
+                t_last, loss_last = t, loss
+                slope = a + dloss
+
+                dt = math.copysign(min(10, abs(phi / slope)), phi)
+                if abs(dt) < 1e-6:
+                    break
+
+                # bisect when a step leaves the bracket, or fails to halve it
+                t = t - dt
+                if not lower < t < upper or (lower > 0 and upper - lower > width / 2):
+                    t = (lower + upper) / 2
+            else:
+                raise RuntimeError("Surface energy balance did not converge.")
+            if t_limit - t < 1e-3:
+                raise RuntimeError(f"{species} temperature above {t_limit} K.")
+
+            T[0] = t
+            for j in range(1, nz):
+                T[j] = alpha[j] * T[j - 1] + beta[j]
+
+            zsum += zk
+            tsum += t
+            loss_sum += loss
+            dloss_sum += dloss
+
+        # In the periodic solution, the absorbed and lost energy balance over a
+        # rotation.  The remaining imbalance is stored in the subsurface, which
+        # otherwise relaxes over many rotations, so shift the temperatures by
+        # the estimated correction.
+        shift = (sun_sum - loss_sum) / dloss_sum
+        shift = math.copysign(min(10, abs(shift)), shift)
+        for j in range(nz):
+            T[j] += shift
+
+        zmean = zsum / nt
+        tmean = tsum / nt
+        converged = abs(zmean - z) <= 1e-4 * zmean and abs(tmean - temperature) < 1e-2
+        z = zmean
+        temperature = tmean
+        logging.debug(
+            "rotation: %d, nt: %d, z: %g, temperature: %f", rotation, nt, z, temperature
+        )
+        if converged:
+            return z, temperature, rotation
+
+    raise RuntimeError("Periodic solution did not converge.")
+
+
+def run_model(
+    species,
+    Av,
+    Air,
+    rh,
+    obliquity,
+    nlat,
+    thermal_inertia,
+    period,
+    nt=96,
+    nz=16,
+    dz0=0.1,
+    growth=1.25,
+    max_rotations=100,
+    temperature0=-1,
+    profiles=False,
+):
+    """Average sublimation for a finite thermal inertia.
+
+
+    Parameters
+    ----------
+    species, Av, Air, rh, obliquity, nlat, temperature0 : see `fastrot.run_model`
+
+    thermal_inertia : float
+        Thermal inertia (J m^-2 K^-1 s^-1/2), > 0.
+
+    period : float
+        Rotation period (hours).
+
+    nt : int
+        Number of time steps per rotation.
+
+    nz : int
+        Number of subsurface layers, including the surface.
+
+    dz0 : float
+        Thickness of the top layer (skin depths).
+
+    growth : float
+        Ratio of the thicknesses of successive layers.
+
+    max_rotations : int
+        Maximum number of rotations to reach a periodic solution, for each of
+        the coarse and full time steps.
+
+    profiles : bool
+        If `True`, also return the latitude profiles.
+
+
+    Returns
+    -------
+    results : dict
+        The same as `fastrot.run_model`, with the additional keys
+        "thermal_inertia" and "period".  With `profiles`, "temperature" and "Z"
+        are the diurnal mean surface temperature and sublimation rate, and
+        "niter" is the number of rotations calculated with the full time step.
+
+    """
+
+    fastrot.check_inputs(species, Av)
+    if thermal_inertia <= 0 or period <= 0:
+        raise ValueError("Thermal inertia and rotation period must be positive.")
+
+    depths = depth_grid(nz, dz0, growth)
+
+    # thermal inertia in cgs units times sqrt(omega): conducted flux per unit
+    # temperature gradient in skin depths
+    omega = 2 * math.pi / (period * 3600)
+    conductance = thermal_inertia * 1e3 * math.sqrt(omega)
+
+    sin_latitude, delta_sin_latitude = fastrot.latitudes(nlat)
+    fracs = fastrot.insolation(obliquity, sin_latitude)
+    sun0 = fastrot.f0 * (1.0 - Av) / rh**2
+
+    # spin up with a coarse time step, then refine
+    steps = [nt] if nt < 2 * spin_up_nt else [spin_up_nt, nt]
+
+    z = [0] * nlat  # diurnal mean sublimation rate
+    surface = [math.nan] * nlat  # diurnal mean surface temperature
+    rotations = [0] * nlat
+    for i in range(nlat):
+        # skip the unilluminated latitudes
+        if fracs[i] == 0:
+            continue
+
+        # start from the isotherm of the infinite thermal inertia limit
+        t = fastrot.equilibrium(species, Av, Air, rh, fracs[i], temperature0)[1]
+        temperatures = [t] * nz
+
+        for n in steps:
+            insolation = [
+                sun0 * frac for frac in step_insolation(sin_latitude[i], obliquity, n)
+            ]
+            z[i], surface[i], rotations[i] = periodic(
+                species, Air, insolation, temperatures, depths, conductance, max_rotations
+            )
+
+        logging.debug(
+            "latitude: %f, rotations: %d, z: %g, temperature: %f",
+            math.degrees(math.asin(sin_latitude[i])),
+            rotations[i],
+            z[i],
+            surface[i],
+        )
+
+    zbar = fastrot.average(z, delta_sin_latitude)
+    results = fastrot.output(species, Av, Air, rh, obliquity, zbar)
+    results["thermal_inertia"] = thermal_inertia
+    results["period"] = period
+
+    if profiles:
+        results["profiles"] = {
+            "latitude": array.array(
+                "d", [math.degrees(math.asin(x)) for x in sin_latitude]
+            ),
+            "frac": array.array("d", fracs),
+            "temperature": array.array("d", surface),
+            "Z": array.array("d", z),
+            "niter": array.array("q", rotations),
+        }
+
+    return results
+
+
+def run_batch(
+    species,
+    Av,
+    Air,
+    rh,
+    obliquity,
+    nlat,
+    thermal_inertia,
+    period,
+    nt=96,
+    nz=16,
+    temperature0=-1,
+    precision="float64",
+):
+    """Average sublimation for many parameter sets, see `fastrot.run_batch`.
+
+
+    Parameters
+    ----------
+    species, nlat, temperature0, precision : see `fastrot.run_batch`
+
+    Av, Air, rh, obliquity, thermal_inertia, period : float or sequence of float
+        Parameters, scalars are repeated to match the sequences.
+
+    nt, nz : int
+        See `run_model`.
+
+
+    Returns
+    -------
+    zbar : array.array
+
+    """
+
+    if precision not in fastrot.precisions:
+        raise ValueError(
+            f"Invalid precision, must be one of {list(fastrot.precisions)}."
+        )
+
+    zbar = array.array(fastrot.precisions["float64"])
+    for params in zip(*fastrot.broadcast(Av, Air, rh, obliquity, thermal_inertia, period)):
+        Av_, Air_, rh_, obl_, ti_, period_ = params
+        results = run_model(
+            species,
+            Av_,
+            Air_,
+            rh_,
+            obl_,
+            nlat,
+            ti_,
+            period_,
+            nt=nt,
+            nz=nz,
+            temperature0=temperature0,
+        )
+        zbar.append(results["Zbar"])
+
+    return fastrot.convert_precision(zbar, precision)
+
+
+description = (
+    "This program calculates the average sublimation per unit area for a rotating"
+    " cometary nucleus with a finite thermal inertia, by solving for the subsurface"
+    " heat conduction over a rotation at each latitude."
+)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "species", choices=fastrot.speciesList, help="Ice species to consider."
+    )
+    parser.add_argument("--Av", metavar="visual_albedo", type=float, required=True)
+    parser.add_argument("--Air", metavar="infrared_albedo", type=float, required=True)
+    parser.add_argument(
+        "--rh", metavar="heliocentric_distance", type=float, required=True
+    )
+    parser.add_argument("--obl", metavar="obliquity", type=float, required=True)
+    parser.add_argument(
+        "--ti",
+        metavar="thermal_inertia",
+        type=float,
+        required=True,
+        help="Thermal inertia (J m^-2 K^-1 s^-1/2)",
+    )
+    parser.add_argument(
+        "--period", metavar="hours", type=float, required=True, help="Rotation period"
+    )
+    parser.add_argument(
+        "--nlat", metavar="n", type=int, default=91, help="Number of latitude steps"
+    )
+    parser.add_argument(
+        "--nt", metavar="n", type=int, default=96, help="Time steps per rotation"
+    )
+    parser.add_argument(
+        "--nz", metavar="n", type=int, default=16, help="Number of subsurface layers"
+    )
+    parser.add_argument(
+        "--profiles", action="store_true", help="Also output the latitude profiles"
+    )
+
+    try:
+        args = parser.parse_args()
+        results = run_model(
+            args.species,
+            args.Av,
+            args.Air,
+            args.rh,
+            args.obl,
+            args.nlat,
+            args.ti,
+            args.period,
+            nt=args.nt,
+            nz=args.nz,
+            profiles=args.profiles,
+        )
+        if args.profiles:
+            results["profiles"] = fastrot.profiles_json(results["profiles"])
+        results = {"status": "success", "results": results}
+    except Exception as e:
+        results = {"status": "failure", "message": str(e)}
+
+    print(json.dumps(results))
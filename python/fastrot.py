@@ -44,6 +44,7 @@ B. Prager 06/24
 """
 
 import csv
+import array
 import math
 import sys
 import json
@@ -59,6 +60,9 @@ boltz = 1.38e-16
 ergcal = 6.953e-17
 proton = 1.67e-24
 
+# array.array type codes for the supported floating-point precisions
+precisions = {"float32": "f", "float64": "d"}
+
 tstart = {
     "H2O": 190,
     "H2O-CH4": 190,
@@ -235,7 +239,182 @@ def sublime(species, temperature):
     return mass, xlt, xltprim, press, pprim, temperature
 
 
-def run_model(species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=1):
+def check_inputs(species, Av):
+    """Validate the species and visual albedo.
+
+
+    Raises
+    ------
+    ValueError
+        For an unknown species or a negative visual albedo.
+
+    """
+
+    if species not in speciesList:
+        logging.error(
+            f'The inputted species of "{species}" is not one of {speciesList}'
+        )
+        raise ValueError("Invalid species.")
+
+    if Av < 0:
+        logging.error(
+            f"A visual albedo of {Av} is not a valid input."
+            " Please input a value greater than 0."
+        )
+        raise ValueError("Invalid visual albedo.")
+
+
+def latitudes(nlat):
+    """Equally spaced values of sin(latitude) from the south to the north pole.
+
+
+    Parameters
+    ----------
+    nlat : int
+        Number of latitude bands.
+
+
+    Returns
+    -------
+    sin_latitude : list of float
+
+    delta_sin_latitude : float
+        sin(latitude) step size.
+
+    """
+
+    sin_latitude = [-1]
+    delta_sin_latitude = 2.0 / (nlat - 1)  # sin(latitude) step size
+
+    for idx in range(1, nlat):
+        sin_latitude.append(sin_latitude[0] + idx * delta_sin_latitude)
+
+    return sin_latitude, delta_sin_latitude
+
+
+def insolation(obliquity, sin_latitude):
+    """Rotationally averaged insolation scale factor at each latitude.
+
+
+    Parameters
+    ----------
+    obliquity : float
+        Obliquity, angle between the object's rotational axis and its orbital
+        axis.
+
+    sin_latitude : list of float
+        Values of sin(latitude), e.g., from `latitudes`.
+
+
+    Returns
+    -------
+    frac : list of float
+        Effective value of cos(theta) for each latitude.
+
+    """
+
+    incl = (90 - obliquity) * math.pi / 180  # radians
+
+    fracs = []
+    for sin_lat in sin_latitude:
+        latitude = math.asin(sin_lat)
+
+        if latitude <= -incl:
+            frac = 0
+        elif latitude > incl:
+            frac = sin_lat * math.cos(incl)
+        else:
+            x1 = (
+                math.cos(incl)
+                * sin_lat
+                * (math.acos(-math.tan(latitude) * (1 / math.tan(incl))))
+                / math.pi
+            )
+            x2 = (
+                math.sin(incl)
+                * math.cos(latitude)
+                * math.sin(math.acos(-math.tan(latitude) / math.tan(incl)))
+                / math.pi
+            )
+            frac = x1 + x2
+
+        fracs.append(frac)
+
+    return fracs
+
+
+def equilibrium(species, Av, Air, rh, frac, temperature0=-1):
+    """Iterate `main_loop` to the equilibrium temperature of one latitude.
+
+
+    Parameters
+    ----------
+    species, Av, Air, rh, frac : see `main_loop`
+
+    temperature0 : float
+        Initial temperature guess, see `run_model`.
+
+
+    Returns
+    -------
+    z : float
+        Sublimation rate, 0 for unilluminated latitudes.
+
+    temperature : float
+        Equilibrium temperature (Kelvins), or `temperature0` for unilluminated
+        latitudes.
+
+    niter : int
+        Number of iterations.
+
+    """
+
+    z = 0
+    niter = 0  # number of iterations for this latitude
+    temperature = temperature0
+    if frac > 0:
+        while niter < 100000:
+            z, temperature, converged = main_loop(
+                species, Av, Air, rh, frac, temperature
+            )
+            niter += 1
+            if converged:
+                break
+        else:
+            raise RuntimeError("Energy balance iteration did not converge.")
+
+    return z, temperature, niter
+
+
+def average(z, delta_sin_latitude):
+    """Average sublimation over the surface of the sphere.
+
+
+    Parameters
+    ----------
+    z : list of float
+        Sublimation rate at each latitude.
+
+    delta_sin_latitude : float
+        sin(latitude) step size.
+
+
+    Returns
+    -------
+    zbar : float
+
+    """
+
+    zbar = 0.0
+    for i in range(0, len(z) - 1):
+        zbar = zbar + 0.5 * (z[i] + z[i + 1]) * delta_sin_latitude
+
+    return zbar / 2
+
+
+def run_model(
+    species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=1, profiles=False
+):
     """
     A call of this function replicates the behavior of the original cgifastrot.f
     script. After reading validating the input parameters, run_model() will
@@ -284,6 +463,9 @@ def run_model(species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=
           - Otherwise: Additional output will be displayed for debugging
             purposes.
 
+    profiles: bool
+        If `True`, also return the latitude profiles.
+
 
     Returns
     -------
@@ -311,20 +493,17 @@ def run_model(species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=
     zlog: float
         zlog = log10(zbar)
 
-    """
+    profiles: dict
+        Only if `profiles` is `True`.  Arrays (array.array) for each latitude:
+          - latitude: latitude (degrees)
+          - frac: insolation scale factor
+          - temperature: equilibrium temperature (K), NaN if unilluminated
+          - Z: sublimation rate (molecules cm^-2 s^-1)
+          - niter: number of energy balance iterations, 64-bit integers
 
-    if species not in speciesList:
-        logging.error(
-            f'The inputted species of "{species}" is not one of {speciesList}'
-        )
-        raise ValueError("Invalid species.")
+    """
 
-    if Av < 0:
-        logging.error(
-            f"A visual albedo of {Av} is not a valid input."
-            " Please input a value greater than 0."
-        )
-        raise ValueError("Invalid visual albedo.")
+    check_inputs(species, Av)
 
     if verbosity == 0:
         logging.basicConfig(level="WARNING")
@@ -338,70 +517,66 @@ def run_model(species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=
         f"Species = {species}, Avis = {Av}, Air = {Air}, r_H = {rh}, Obl = {obliquity}"
     )
 
-    incl = (90 - obliquity) * math.pi / 180  # radians
+    sin_latitude, delta_sin_latitude = latitudes(nlat)
+    fracs = insolation(obliquity, sin_latitude)
 
     z = [0] * nlat  # sublimation rate as a function of latitude
-    sin_latitude = [-1]
-    delta_sin_latitude = 2.0 / (nlat - 1)  # sin(latitude) step size
-
-    for idx in range(1, nlat):
-        sin_latitude.append(sin_latitude[0] + idx * delta_sin_latitude)
-
+    temperatures = [math.nan] * nlat  # equilibrium temperature
+    niters = [0] * nlat  # number of iterations
     niter_total = 0  # total number of iterations for all latitudes
     for i in range(0, nlat):
-        latitude = math.asin(sin_latitude[i])
-        frac = 0  # insolation scale factor at latitude
-
-        if latitude <= -incl:
-            frac = 0
-        elif latitude > incl:
-            frac = sin_latitude[i] * math.cos(incl)
-        else:
-            x1 = (
-                math.cos(incl)
-                * sin_latitude[i]
-                * (math.acos(-math.tan(latitude) * (1 / math.tan(incl))))
-                / math.pi
-            )
-            x2 = (
-                math.sin(incl)
-                * math.cos(latitude)
-                * math.sin(math.acos(-math.tan(latitude) / math.tan(incl)))
-                / math.pi
-            )
-            frac = x1 + x2
-
-        niter = 0  # number of iterations for this latitude
-        temperature = temperature0
-        if frac > 0:
-            while niter < 100000:
-                z[i], temperature, converged = main_loop(
-                    species, Av, Air, rh, frac, temperature
-                )
-                niter += 1
-                if converged:
-                    break
-            else:
-                raise RuntimeError("Energy balance iteration did not converge.")
+        z[i], temperature, niter = equilibrium(
+            species, Av, Air, rh, fracs[i], temperature0
+        )
+        if niter > 0:
+            temperatures[i] = temperature
+        niters[i] = niter
 
         logging.debug(
             "obliquity: %f, latitude: %f, z: %g, iterations: %d",
             obliquity,
-            latitude * 180 / math.pi,
+            math.asin(sin_latitude[i]) * 180 / math.pi,
             z[i],
             niter,
         )
         niter_total += niter
 
-    zbar = 0.0
-    for i in range(0, nlat - 1):
-        zbar = zbar + 0.5 * (z[i] + z[i + 1]) * delta_sin_latitude
+    zbar = average(z, delta_sin_latitude)
+    results = output(species, Av, Air, rh, obliquity, zbar)
+
+    logging.info("Final Results:")
+    logging.info(results)
+
+    if profiles:
+        results["profiles"] = {
+            "latitude": array.array(
+                "d", [math.degrees(math.asin(x)) for x in sin_latitude]
+            ),
+            "frac": array.array("d", fracs),
+            "temperature": array.array("d", temperatures),
+            "Z": array.array("d", z),
+            "niter": array.array("q", niters),
+        }
+
+    return results
+
+
+def profiles_json(profiles):
+    """Latitude profiles as lists for JSON output, with `None` for NaN."""
+
+    return {
+        k: [None if isinstance(x, float) and math.isnan(x) else x for x in v]
+        for k, v in profiles.items()
+    }
+
+
+def output(species, Av, Air, rh, obliquity, zbar):
+    """Model results dictionary, as returned by `run_model`."""
 
-    zbar = zbar / 2
     zlog = math.log10(zbar)
     rlog = math.log10(rh)
 
-    output = {
+    return {
         "species": species,
         "obliquity": obliquity,
         "r_H": rh,
@@ -412,9 +587,153 @@ def run_model(species, Av, Air, rh, obliquity, nlat, temperature0=-1, verbosity=
         "Zlog": zlog,
     }
 
-    logging.info("Final Results:")
-    logging.info(output)
-    return output
+
+def broadcast(*params):
+    """Repeat scalar parameters to match the length of the sequences.
+
+
+    Parameters
+    ----------
+    *params : float or sequence of float
+        Sequences must have the same length.
+
+
+    Returns
+    -------
+    params : list of sequence
+
+    """
+
+    n = None
+    for p in params:
+        if isinstance(p, (int, float)):
+            continue
+        if n is None:
+            n = len(p)
+        elif len(p) != n:
+            raise ValueError("Parameter sequences must have the same length.")
+
+    if n is None:
+        n = 1
+    return [[p] * n if isinstance(p, (int, float)) else p for p in params]
+
+
+def run_batch(
+    species, Av, Air, rh, obliquity, nlat, temperature0=-1, precision="float64"
+):
+    """Average sublimation for many parameter sets of one species.
+
+    The results are identical to those of `run_model`, but the per-call logging
+    is skipped and the latitude grid and insolation factors are computed once
+    and shared between parameter sets.
+
+
+    Parameters
+    ----------
+    species : str
+        Ice species to consider, see `run_model`.
+
+    Av, Air, rh, obliquity : float or sequence of float
+        Visual albedo, infrared albedo, heliocentric distance (au), and
+        obliquity.  Sequences must have the same length; scalars are repeated
+        for every parameter set.
+
+    nlat : int
+        Number of latitude bands to calculate.
+
+    temperature0: float
+        Initial temperature guess, see `run_model`.
+
+    precision : str
+        Precision of the returned array: "float64" or "float32".  The energy
+        balance and the latitude integration are always computed in double
+        precision; "float32" halves the memory of the results.
+
+
+    Returns
+    -------
+    zbar : array.array
+        Average sublimation (in molecules cm^-2 s^-1) for each parameter set.
+
+    """
+
+    if precision not in precisions:
+        raise ValueError(f"Invalid precision, must be one of {list(precisions)}.")
+
+    params = broadcast(Av, Air, rh, obliquity)
+    check_inputs(species, min(params[0]))
+
+    sin_latitude, delta_sin_latitude = latitudes(nlat)
+    fracs = {}  # insolation factors, by obliquity
+
+    zbar = array.array(precisions["float64"])
+    for Av_, Air_, rh_, obl_ in zip(*params):
+        if obl_ not in fracs:
+            fracs[obl_] = insolation(obl_, sin_latitude)
+
+        z = [
+            equilibrium(species, Av_, Air_, rh_, frac, temperature0)[0]
+            for frac in fracs[obl_]
+        ]
+        zbar.append(average(z, delta_sin_latitude))
+
+    return convert_precision(zbar, precision)
+
+
+def convert_precision(zbar, precision):
+    """Convert double-precision results to `precision`, see `run_batch`."""
+
+    if precision == "float32":
+        zbar = array.array(precisions[precision], zbar)
+    return zbar
+
+
+def surface_loss(species, Air, temperature):
+    """Energy lost from the surface by thermal emission and sublimation.
+
+
+    Parameters
+    ----------
+    species: str
+        Inputted species
+
+    Air : float
+        Infrared albedo
+
+    temperature : float
+        Surface temperature (Kelvins), see `sublime`.
+
+
+    Returns
+    -------
+    loss : float
+        Emitted and sublimation energy flux (erg cm^-2 s^-1).
+
+    dloss : float
+        Derivative of `loss` with respect to temperature.
+
+    z : float
+        Sublimation rate.
+
+    temperature : float
+        The temperature at which the loss was evaluated, see `sublime`.
+
+    """
+
+    mass, xlt, xltprim, press, pprim, temperature = sublime(species, temperature)
+    root = 1 / math.sqrt(mass * 2 * math.pi * boltz)
+    root_t = math.sqrt(temperature)
+    radiat = (1 - Air) * sigma * temperature**4
+    evap = root / root_t * press * xlt
+    z = max(evap / xlt, 1e-30)
+
+    drad = 4 * radiat / temperature
+    x1 = pprim * xlt
+    x2 = press * xltprim
+
+    devap = root / root_t * (x1 + x2)
+
+    return radiat + evap, drad + devap, z, temperature
 
 
 def main_loop(species, Av, Air, rh, frac, temperature):
@@ -455,21 +774,9 @@ def main_loop(species, Av, Air, rh, frac, temperature):
 
     """
 
-    mass, xlt, xltprim, press, pprim, temperature = sublime(species, temperature)
-    root = 1 / math.sqrt(mass * 2 * math.pi * boltz)
-    root_t = math.sqrt(temperature)
+    loss, phipri, z, temperature = surface_loss(species, Air, temperature)
     sun = f0 * frac * (1.0 - Av) / rh**2
-    radiat = (1 - Air) * sigma * temperature**4
-    evap = root / root_t * press * xlt
-    phi = radiat + evap - sun
-    z = max(evap / xlt, 1e-30)
-
-    drad = 4 * radiat / temperature
-    x1 = pprim * xlt
-    x2 = press * xltprim
-
-    devap = root / root_t * (x1 + x2)
-    phipri = drad + devap
+    phi = loss - sun
 
     dt = math.copysign(min(10, abs(phi / phipri / 2)), phi / phipri)
     temperature -= dt
@@ -538,6 +845,11 @@ if __name__ == "__main__":
         "CO2: 100 K\n"
         "CO: 60 K\n",
     )
+    parser.add_argument(
+        "--profiles",
+        action="store_true",
+        help="Also output the latitude profiles (not saved to CSV files)",
+    )
     parser.add_argument(
         "-o", metavar="filename", dest="filename", help="Save results to this file name"
     )
@@ -567,8 +879,12 @@ if __name__ == "__main__":
                 args.nlat,
                 args.temp,
                 args.verbosity,
+                profiles=args.profiles,
             ),
         }
+        if args.profiles:
+            profile = results["results"]["profiles"]
+            results["results"]["profiles"] = profiles_json(profile)
     except Exception as e:
         results = {"status": "failure", "message": str(e)}
 
@@ -579,8 +895,9 @@ if __name__ == "__main__":
             with open(args.filename, "w") as json_file:
                 json.dump(results, json_file)
         else:
-            fieldnames = list(results["results"].keys())
+            row = dict(results["results"])
+            row.pop("profiles", None)
             with open(args.filename, "w") as csv_file:
-                writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+                writer = csv.DictWriter(csv_file, fieldnames=list(row.keys()))
                 writer.writeheader()
-                writer.writerow(results["results"])
+                writer.writerow(row)
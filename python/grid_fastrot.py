@@ -0,0 +1,408 @@
+"""
+    Description
+    -----------
+    grid_fastrot.py precomputes Zbar from fastrot.py over a dense grid of
+    parameters, and interpolates the grid for fast look ups.
+
+    The grid spans (Av, Air, log10(rh), obliquity) for each species, and is
+    saved as log10(Zbar) in single precision to a binary file:
+        - 16-byte preamble: the string "FASTROTG", the file format version,
+          and the length of the JSON header, as little-endian unsigned 32-bit
+          integers
+        - JSON header: format version, species, axes, nlat, and byte order
+        - log10(Zbar) as 32-bit floats, C-ordered by (species, Av, Air,
+          log10(rh), obliquity), starting at a multiple of 8 bytes
+
+    `ZbarGrid` reads the file lazily through a memory map, and interpolates
+    log10(Zbar) multilinearly.  Points outside of the grid are evaluated with
+    `fastrot.run_batch` at the grid's number of latitude steps, or rejected.
+
+
+    Parameters
+    ----------
+    species : str
+        Ice species to consider: 'H2O', 'H2O-CH4', 'CO2', 'CO'
+    Av : float
+        Visual albedo
+    Air : float
+        Infrared albedo
+    rh : float
+        Heliocentric distance (in au)
+    obliquity : float
+        Obliquity - 90 - angle between rotation axis and the solar direction
+
+
+    Returns
+    -------
+    zbar : array.array
+        Average sublimation (in molecules cm^-2 s^-1)
+"""
+import sys
+import math
+import mmap
+import json
+import array
+import struct
+import bisect
+from itertools import product
+import fastrot
+import survey_fastrot
+
+magic = b"FASTROTG"
+version = 1
+preamble = struct.Struct("<8sII")
+
+# interpolation axes, in the order of the data
+axis_names = ["Av", "Air", "log_rh", "obliquity"]
+
+
+def build(
+    path,
+    species_set,
+    Av_set,
+    Air_set,
+    log_rh_set,
+    obl_set,
+    nlat=181,
+    chunk_size=10000,
+):
+    """Compute a grid file.
+
+
+    Parameters
+    ----------
+    path : str
+        File name.
+
+    species_set : list of str
+        Ice species.
+
+    Av_set, Air_set, log_rh_set, obl_set : list of float
+        Axis values, in increasing order.  log_rh_set is log10(rh/au).
+
+    nlat : int
+        Number of latitude steps.
+
+    chunk_size : int
+        Number of grid points evaluated at a time.
+
+
+    Returns
+    -------
+    header : dict
+
+    """
+
+    for name, axis in zip(axis_names, [Av_set, Air_set, log_rh_set, obl_set]):
+        if any(a >= b for a, b in zip(axis[:-1], axis[1:])):
+            raise ValueError(f"{name} axis values must be in increasing order.")
+
+    header = {
+        "version": version,
+        "species": list(species_set),
+        "axes": {
+            "Av": list(Av_set),
+            "Air": list(Air_set),
+            "log_rh": list(log_rh_set),
+            "obliquity": list(obl_set),
+        },
+        "nlat": nlat,
+        "byteorder": sys.byteorder,
+    }
+    encoded = json.dumps(header).encode()
+    encoded += b" " * (-(preamble.size + len(encoded)) % 8)
+    offset = preamble.size + len(encoded)
+
+    axes = survey_fastrot.make_axes(
+        list(species_set),
+        list(Av_set),
+        list(Air_set),
+        [10**x for x in log_rh_set],
+        list(obl_set),
+    )
+    npoints = 4
+    for name in survey_fastrot.axis_names:
+        npoints *= len(axes[name])
+
+    with open(path, "w+b") as outf:
+        outf.write(preamble.pack(magic, version, len(encoded)))
+        outf.write(encoded)
+        outf.truncate(offset + npoints)
+
+        mm = mmap.mmap(outf.fileno(), 0)
+        data = memoryview(mm)[offset:].cast("f")
+        try:
+            for species, start, params in survey_fastrot.chunks(axes, chunk_size):
+                zbar = fastrot.run_batch(species, *params, nlat)
+                data[start : start + len(zbar)] = array.array(
+                    "f", [math.log10(z) for z in zbar]
+                )
+            mm.flush()
+        finally:
+            data.release()
+            mm.close()
+
+    return header
+
+
+class ZbarGrid:
+    """Interpolate a grid file.
+
+    The file header is read on initialization, the data are memory mapped on
+    the first query.
+
+
+    Parameters
+    ----------
+    path : str
+        File name.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as inf:
+            tag, file_version, length = preamble.unpack(inf.read(preamble.size))
+            if tag != magic:
+                raise ValueError(f"{path} is not a fastrot grid file.")
+            if file_version != version:
+                raise ValueError(
+                    f"Unsupported grid file version {file_version}, expected {version}."
+                )
+            self.header = json.loads(inf.read(length))
+
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError("Grid file byte order does not match this system.")
+
+        self.offset = preamble.size + length
+        self.nlat = self.header["nlat"]
+        self.species = self.header["species"]
+        self.axes = [self.header["axes"][name] for name in axis_names]
+
+        # array strides
+        self.strides = [1, 1, 1, 1]
+        for i in range(2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * len(self.axes[i + 1])
+        self.species_stride = self.strides[0] * len(self.axes[0])
+
+        self._mm = None
+        self._data = None
+
+    @property
+    def data(self):
+        """log10(Zbar), flattened."""
+
+        if self._data is None:
+            with open(self.path, "rb") as inf:
+                self._mm = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = memoryview(self._mm)[self.offset :].cast("f")
+        return self._data
+
+    def close(self):
+        if self._data is not None:
+            self._data.release()
+            self._mm.close()
+            self._data = None
+            self._mm = None
+
+    def in_bounds(self, Av, Air, rh, obliquity):
+        """Test if a point is within the grid."""
+
+        if rh <= 0:
+            return False
+
+        x = (Av, Air, math.log10(rh), obliquity)
+        return all(axis[0] <= v <= axis[-1] for axis, v in zip(self.axes, x))
+
+    def _interpolate(self, start, x):
+        # corner indices and weights for each axis
+        corners = []
+        for axis, stride, v in zip(self.axes, self.strides, x):
+            if len(axis) == 1:
+                corners.append([(0, 1.0)])
+                continue
+
+            j = min(bisect.bisect_right(axis, v) - 1, len(axis) - 2)
+            t = (v - axis[j]) / (axis[j + 1] - axis[j])
+            if t == 0:
+                corners.append([(j * stride, 1.0)])
+            else:
+                corners.append([(j * stride, 1 - t), ((j + 1) * stride, t)])
+
+        data = self.data
+        logz = 0.0
+        for corner in product(*corners):
+            w = 1.0
+            k = start
+            for index, weight in corner:
+                k += index
+                w *= weight
+            logz += w * data[k]
+
+        return logz
+
+    def query(self, species, Av, Air, rh, obliquity, fallback=True):
+        """Zbar for one or more points.
+
+
+        Parameters
+        ----------
+        species : str
+            Ice species.
+
+        Av, Air, rh, obliquity : float or sequence of float
+            Parameters, broadcast as for `fastrot.run_batch`.
+
+        fallback : bool
+            If `True`, points outside of the grid are computed with
+            `fastrot.run_batch`.  Otherwise, they raise a `ValueError`.
+
+
+        Returns
+        -------
+        zbar : array.array
+
+        """
+
+        if species not in self.species:
+            if not fallback:
+                raise ValueError(f"{species} is not in the grid.")
+            return fastrot.run_batch(species, Av, Air, rh, obliquity, self.nlat)
+
+        start = self.species.index(species) * self.species_stride
+        params = fastrot.broadcast(Av, Air, rh, obliquity)
+
+        zbar = array.array("d")
+        outside = []
+        for i, point in enumerate(zip(*params)):
+            if self.in_bounds(*point):
+                Av_, Air_, rh_, obl_ = point
+                x = (Av_, Air_, math.log10(rh_), obl_)
+                zbar.append(10 ** self._interpolate(start, x))
+            elif fallback:
+                outside.append(i)
+                zbar.append(math.nan)
+            else:
+                raise ValueError(f"Point {point} is outside of the grid.")
+
+        if outside:
+            exact = fastrot.run_batch(
+                species, *[[p[i] for i in outside] for p in params], self.nlat
+            )
+            for i, z in zip(outside, exact):
+                zbar[i] = z
+
+        return zbar
+
+
+def frange(start, stop, step):
+    """Evenly spaced values, including `stop`."""
+
+    n = round((stop - start) / step)
+    return [round(start + i * step, 10) for i in range(n + 1)]
+
+
+description = (
+    "Use this program to precompute Zbar over a grid of parameters, or to"
+    " interpolate a precomputed grid."
+)
+
+if __name__ == "__main__":
+    import argparse
+
+    speciesList = ["H2O", "H2O-CH4", "CO2", "CO"]
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    build_parser = subparsers.add_parser("build", help="compute a grid file")
+    build_parser.add_argument("filename", help="Grid file name")
+    build_parser.add_argument(
+        "--species_set",
+        metavar="species",
+        choices=speciesList,
+        nargs="+",
+        default=speciesList,
+        help="Ice species to consider.",
+    )
+    build_parser.add_argument(
+        "--Av_set",
+        nargs="+",
+        metavar="visual_albedo",
+        type=float,
+        default=[0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5],
+    )
+    build_parser.add_argument(
+        "--Air_set",
+        nargs="+",
+        metavar="infrared_albedo",
+        type=float,
+        default=[0, 0.05, 0.1, 0.2, 0.3],
+    )
+    build_parser.add_argument(
+        "--log_rh",
+        nargs=3,
+        metavar=("start", "stop", "step"),
+        type=float,
+        default=[-1, 1.5, 0.05],
+        help="log10 heliocentric distance range",
+    )
+    build_parser.add_argument(
+        "--obl",
+        nargs=3,
+        metavar=("start", "stop", "step"),
+        type=float,
+        default=[0, 90, 5],
+        help="Obliquity range",
+    )
+    build_parser.add_argument(
+        "--nlat", metavar="n", type=int, default=181, help="Number of latitude steps"
+    )
+
+    query_parser = subparsers.add_parser("query", help="interpolate a grid file")
+    query_parser.add_argument("filename", help="Grid file name")
+    query_parser.add_argument("species", choices=speciesList, help="Ice species.")
+    query_parser.add_argument("--Av", metavar="visual_albedo", type=float, required=True)
+    query_parser.add_argument(
+        "--Air", metavar="infrared_albedo", type=float, required=True
+    )
+    query_parser.add_argument(
+        "--rh", metavar="heliocentric_distance", type=float, required=True
+    )
+    query_parser.add_argument("--obl", metavar="obliquity", type=float, required=True)
+    query_parser.add_argument(
+        "--no-fallback",
+        dest="fallback",
+        action="store_false",
+        help="Fail for points outside of the grid, rather than running the model",
+    )
+
+    args = parser.parse_args()
+    if args.mode == "build":
+        build(
+            args.filename,
+            args.species_set,
+            args.Av_set,
+            args.Air_set,
+            frange(*args.log_rh),
+            frange(*args.obl),
+            nlat=args.nlat,
+        )
+    else:
+        try:
+            grid = ZbarGrid(args.filename)
+            zbar = grid.query(
+                args.species, args.Av, args.Air, args.rh, args.obl, fallback=args.fallback
+            )[0]
+            results = {
+                "status": "success",
+                "results": fastrot.output(
+                    args.species, args.Av, args.Air, args.rh, args.obl, zbar
+                ),
+            }
+        except Exception as e:
+            results = {"status": "failure", "message": str(e)}
+
+        print(json.dumps(results))
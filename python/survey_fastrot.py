@@ -44,22 +44,87 @@
             - "Zlog" : float
     'results/output.json` : .json file
     `results/output.csv` : .csv file
+    `results/profiles.bin` : binary file, optional
+        Latitude profiles (see `fastrot.run_model`) as 64-bit floats, indexed by
+        (result, field, latitude), with metadata in `results/profiles.bin.json`.
+        Open with `load_memmap`.
+
+    Large grids may be computed out of core with `survey_memmap`, which tiles
+    the parameter space into chunks and writes Zbar directly into a binary file
+    indexed by (species, Av, Air, rh, obliquity), with the axis values stored in
+    a JSON file alongside.  Open the results with `load_memmap`, which reads
+    points or slices of the grid without loading the rest of it into memory.
+
+    Both surveys take an optional thermal inertia and rotation period, to use
+    the finite thermal inertia model of diurnal_fastrot.py instead.  It is
+    several hundred times slower per grid point than fastrot.py.
 """
 import os
 import csv
+import sys
+import mmap
+import array
+import operator
 import fastrot
+import diurnal_fastrot
 from itertools import product
-from json import dump
+from json import dump, load
 
+axis_names = ["species", "Av", "Air", "rh", "obliquity"]
+profile_fields = ["latitude", "frac", "temperature", "Z", "niter"]
 
-def survey_fastrot(species_set, Av_set, Air_set, rh_set, obl_set, nlat):
+
+def survey_fastrot(
+    species_set,
+    Av_set,
+    Air_set,
+    rh_set,
+    obl_set,
+    nlat,
+    profiles=False,
+    thermal_inertia=None,
+    period=None,
+):
+    check_diurnal(thermal_inertia, period)
     search_space = []
     arguments = locals()
     for param in [species_set, Av_set, Air_set, rh_set, obl_set, nlat]:
         search_space.append(param if isinstance(param, list) else [param])
     results = []
-    for inputs in product(*search_space):
-        results.append(fastrot.run_model(*inputs))
+    if profiles:
+        if len(search_space[5]) != 1:
+            raise ValueError("Latitude profiles require a single value of nlat.")
+        profiles_path = os.path.join(os.getcwd(), "results", "profiles.bin")
+        profiles_file = open(profiles_path, "wb")
+    try:
+        for inputs in product(*search_space):
+            if thermal_inertia is None:
+                results.append(fastrot.run_model(*inputs, profiles=profiles))
+            else:
+                results.append(
+                    diurnal_fastrot.run_model(
+                        *inputs, thermal_inertia, period, profiles=profiles
+                    )
+                )
+            if profiles:
+                profile = results[-1].pop("profiles")
+                for field in profile_fields:
+                    array.array("d", profile[field]).tofile(profiles_file)
+    finally:
+        if profiles:
+            profiles_file.close()
+
+    if profiles:
+        # the latitude profiles, readable with load_memmap
+        metadata = {
+            "quantity": "profiles",
+            "precision": "float64",
+            "byteorder": sys.byteorder,
+            "shape": [len(results), len(profile_fields), search_space[5][0]],
+            "fields": profile_fields,
+        }
+        with open(profiles_path + ".json", "w") as json_file:
+            dump(metadata, json_file)
 
     output_json = {"results": results}
     json_path = os.path.join(os.getcwd(), "results", "output.json")
@@ -77,6 +142,334 @@ def survey_fastrot(species_set, Av_set, Air_set, rh_set, obl_set, nlat):
     return output_json
 
 
+def check_diurnal(thermal_inertia, period):
+    """Require both or neither of the thermal inertia and rotation period."""
+
+    if (thermal_inertia is None) != (period is None):
+        raise ValueError("Thermal inertia and rotation period must be given together.")
+
+
+def make_axes(species_set, Av_set, Air_set, rh_set, obl_set):
+    """Parameter grid axes, keyed by `axis_names`, from lists or values."""
+
+    axes = {}
+    for name, param in zip(axis_names, [species_set, Av_set, Air_set, rh_set, obl_set]):
+        axes[name] = param if isinstance(param, list) else [param]
+    return axes
+
+
+def chunks(axes, chunk_size):
+    """Tile a parameter grid into chunks.
+
+    Chunks do not span more than one species, and each covers a contiguous
+    range of the flattened (C-ordered) grid.
+
+
+    Parameters
+    ----------
+    axes : dict
+        Lists of parameter values, keyed by `axis_names`.
+
+    chunk_size : int
+        Maximum number of grid points per chunk.
+
+
+    Yields
+    ------
+    species : str
+
+    offset : int
+        Flat index of the first grid point of the chunk.
+
+    params : list of list
+        Av, Air, rh, and obliquity of each grid point in the chunk.
+
+    """
+
+    shape = [len(axes[name]) for name in axis_names[1:]]
+    n = shape[0] * shape[1] * shape[2] * shape[3]
+    for s, species in enumerate(axes["species"]):
+        for start in range(0, n, chunk_size):
+            params = [[], [], [], []]
+            for k in range(start, min(start + chunk_size, n)):
+                # decode the flat index, last axis varies fastest
+                for i in range(3, -1, -1):
+                    k, j = divmod(k, shape[i])
+                    params[i].append(axes[axis_names[i + 1]][j])
+            yield species, s * n + start, params
+
+
+def create_memmap(path, axes, nlat, precision="float64", attributes=None):
+    """Create a grid file and its metadata.
+
+
+    Parameters
+    ----------
+    path : str
+        Grid file name.  The metadata are saved to `path` + ".json".
+
+    axes : dict
+        Lists of parameter values, keyed by `axis_names`.
+
+    nlat : int
+        Number of latitude steps.
+
+    precision : str
+        "float64" or "float32".
+
+    attributes : dict, optional
+        Additional metadata, e.g., the thermal inertia and rotation period.
+
+
+    Returns
+    -------
+    mm : mmap.mmap
+        The memory-mapped file, zero filled.
+
+    metadata : dict
+
+    """
+
+    if precision not in fastrot.precisions:
+        raise ValueError(f"Invalid precision, must be one of {list(fastrot.precisions)}.")
+
+    metadata = {
+        "quantity": "Zbar",
+        "precision": precision,
+        "byteorder": sys.byteorder,
+        "nlat": nlat,
+        "shape": [len(axes[name]) for name in axis_names],
+        "axes": {name: list(axes[name]) for name in axis_names},
+    }
+    if attributes is not None:
+        metadata.update(attributes)
+    with open(path + ".json", "w") as json_file:
+        dump(metadata, json_file)
+
+    itemsize = 4 if precision == "float32" else 8
+    size = itemsize
+    for n in metadata["shape"]:
+        size *= n
+
+    with open(path, "w+b") as grid_file:
+        grid_file.truncate(size)
+        return mmap.mmap(grid_file.fileno(), size), metadata
+
+
+class MemmapGrid:
+    """Read-only N-dimensional view of a memory-mapped grid file.
+
+    Index with one integer or slice per axis, as for a numpy array.  Trailing
+    axes may be omitted.  Integers for all axes return a single value, otherwise
+    the selected values are returned as a flat `array.array`, in C order, and
+    `hyperslab` also returns their shape.  Only the selected values are read
+    from disk.
+
+
+    Parameters
+    ----------
+    mm : mmap.mmap
+        The memory-mapped file.
+
+    typecode : str
+        `array` type code of the values.
+
+    shape : list of int
+
+    """
+
+    def __init__(self, mm, typecode, shape):
+        self._mm = mm
+        self.data = memoryview(mm).cast(typecode)
+        self.shape = tuple(shape)
+
+        # flat index strides
+        self.strides = [1] * len(shape)
+        for i in range(len(shape) - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * shape[i + 1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.release()
+        self._mm.close()
+
+    def _key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > len(self.shape):
+            raise IndexError(f"Too many indices for a {len(self.shape)}-D grid.")
+        key += (slice(None),) * (len(self.shape) - len(key))
+
+        indices = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                indices.append(range(*k.indices(n)))
+            else:
+                k = operator.index(k)
+                if not -n <= k < n:
+                    raise IndexError(f"Index {k} is out of bounds for axis of size {n}.")
+                indices.append(k % n)
+        return indices
+
+    def hyperslab(self, key):
+        """Read the values selected by `key`.
+
+
+        Returns
+        -------
+        values : array.array
+            Flat, in C order.
+
+        shape : tuple of int
+            Shape of the selection, omitting the integer-indexed axes.
+
+        """
+
+        indices = self._key(key)
+        shape = tuple(len(k) for k in indices if isinstance(k, range))
+
+        # flat offsets of the outer axes, then copy runs along the last axis
+        *outer, last = [k if isinstance(k, range) else range(k, k + 1) for k in indices]
+        values = array.array(self.data.format)
+        if len(last) == 0:
+            return values, shape
+
+        for outer_index in product(*outer):
+            offset = sum(k * stride for k, stride in zip(outer_index, self.strides))
+            first = offset + last[0]
+            final = offset + last[-1]
+            if last.step > 0:
+                values.frombytes(self.data[first : final + 1 : last.step].tobytes())
+            else:
+                run = array.array(self.data.format)
+                run.frombytes(self.data[final : first + 1 : -last.step].tobytes())
+                run.reverse()
+                values.extend(run)
+
+        return values, shape
+
+    def __getitem__(self, key):
+        indices = self._key(key)
+        if not any(isinstance(k, range) for k in indices):
+            return self.data[sum(k * s for k, s in zip(indices, self.strides))]
+        return self.hyperslab(key)[0]
+
+
+def load_memmap(path):
+    """Open a grid file, read only.
+
+    The data are not read into memory, but paged in from disk as needed.
+
+
+    Returns
+    -------
+    grid : MemmapGrid
+        Zbar indexed by (species, Av, Air, rh, obliquity) indices, e.g.,
+        ``grid[0, 1, 0, 5, 2]`` for one point, or ``grid[0, 1, 0, :, 2]`` for
+        all rh.  Zeros mark grid points that were not computed.  Close it with
+        `grid.close()`, or use it as a context manager.
+
+    metadata : dict
+        Including the axis values, metadata["axes"], keyed by `axis_names`.
+
+    """
+
+    with open(path + ".json") as json_file:
+        metadata = load(json_file)
+
+    if metadata["byteorder"] != sys.byteorder:
+        raise ValueError("Grid file byte order does not match this system.")
+
+    with open(path, "rb") as grid_file:
+        mm = mmap.mmap(grid_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    typecode = fastrot.precisions[metadata["precision"]]
+    return MemmapGrid(mm, typecode, metadata["shape"]), metadata
+
+
+def survey_memmap(
+    species_set,
+    Av_set,
+    Air_set,
+    rh_set,
+    obl_set,
+    nlat,
+    path,
+    chunk_size=10000,
+    precision="float64",
+    thermal_inertia=None,
+    period=None,
+):
+    """Out-of-core survey into a memory-mapped grid file.
+
+    Memory use is set by `chunk_size` rather than the size of the grid.
+
+
+    Parameters
+    ----------
+    species_set, Av_set, Air_set, rh_set, obl_set : list or value
+        Parameter values.
+
+    nlat : int
+        Number of latitude steps.
+
+    path : str
+        Grid file name, see `create_memmap`.
+
+    chunk_size : int
+        Number of grid points evaluated at a time.
+
+    precision : str
+        "float64" or "float32".
+
+    thermal_inertia, period : float, optional
+        Use `diurnal_fastrot.run_batch` with this thermal inertia (J m^-2 K^-1
+        s^-1/2) and rotation period (hours), which are saved in the metadata.
+
+
+    Returns
+    -------
+    metadata : dict
+
+    """
+
+    check_diurnal(thermal_inertia, period)
+    axes = make_axes(species_set, Av_set, Air_set, rh_set, obl_set)
+    attributes = None
+    if thermal_inertia is not None:
+        attributes = {"thermal_inertia": thermal_inertia, "period": period}
+    mm, metadata = create_memmap(path, axes, nlat, precision, attributes)
+    grid = memoryview(mm).cast(fastrot.precisions[precision])
+    try:
+        for species, offset, params in chunks(axes, chunk_size):
+            if thermal_inertia is None:
+                zbar = fastrot.run_batch(species, *params, nlat, precision=precision)
+            else:
+                zbar = diurnal_fastrot.run_batch(
+                    species,
+                    *params,
+                    nlat,
+                    thermal_inertia,
+                    period,
+                    precision=precision,
+                )
+            grid[offset : offset + len(zbar)] = zbar
+        mm.flush()
+    finally:
+        grid.release()
+        mm.close()
+
+    return metadata
+
+
 description = "Use this program to iterate `fastrot.py` over a desired parameter space."
 
 if __name__ == "__main__":
@@ -122,11 +515,74 @@ if __name__ == "__main__":
     parser.add_argument(
         "--nlat", metavar="n", type=int, default=181, help="Number of latitude steps"
     )
+    parser.add_argument(
+        "--profiles",
+        action="store_true",
+        help="Save the latitude profiles to results/profiles.bin",
+    )
+    parser.add_argument(
+        "--ti",
+        metavar="thermal_inertia",
+        type=float,
+        help="Thermal inertia (J m^-2 K^-1 s^-1/2), see diurnal_fastrot.py",
+    )
+    parser.add_argument(
+        "--period",
+        metavar="hours",
+        type=float,
+        help="Rotation period (with --ti)",
+    )
+    parser.add_argument(
+        "--memmap",
+        metavar="filename",
+        help="Compute the grid out of core into this memory-mapped file",
+    )
+    parser.add_argument(
+        "--chunk",
+        metavar="n",
+        type=int,
+        default=10000,
+        help="Number of grid points per chunk (with --memmap)",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=list(fastrot.precisions),
+        default="float64",
+        help="Grid file precision (with --memmap)",
+    )
 
     try:
         args = parser.parse_args()
-        survey_fastrot(
-            args.species_set, args.Av_set, args.Air_set, args.rh_set, args.obl_set, args.nlat
-        )
+        if args.memmap is not None and args.profiles:
+            parser.error("--profiles is not available with --memmap")
+        if (args.ti is None) != (args.period is None):
+            parser.error("--ti and --period must be given together")
+
+        if args.memmap is None:
+            survey_fastrot(
+                args.species_set,
+                args.Av_set,
+                args.Air_set,
+                args.rh_set,
+                args.obl_set,
+                args.nlat,
+                profiles=args.profiles,
+                thermal_inertia=args.ti,
+                period=args.period,
+            )
+        else:
+            survey_memmap(
+                args.species_set,
+                args.Av_set,
+                args.Air_set,
+                args.rh_set,
+                args.obl_set,
+                args.nlat,
+                args.memmap,
+                chunk_size=args.chunk,
+                precision=args.precision,
+                thermal_inertia=args.ti,
+                period=args.period,
+            )
     except Exception as e:
         print(e)
@@ -0,0 +1,32 @@
+"""Shared reporting for the test scripts.
+
+Importing this module also puts the fastrot scripts on the module search path.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+RESET = "\033[00m"
+OKGREEN = "\033[32m"
+FAIL = "\033[31m"
+
+failures = 0
+
+
+def check(message, passed):
+    """Print the result of a test and count the failures."""
+
+    global failures
+    if passed:
+        print(f"{message}: {OKGREEN}success{RESET}")
+    else:
+        print(f"{message}: {FAIL}fail{RESET}")
+        failures += 1
+
+
+def finish():
+    """Exit with a non-zero status if any test failed."""
+
+    sys.exit(failures > 0)
@@ -0,0 +1,122 @@
+"""Test the asyncio interface: coalescing, cancellation, and backpressure."""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from checks import check, finish  # first, puts the scripts on the path
+import fastrot
+import async_fastrot
+
+
+class Recorder:
+    """Wrap fastrot.run_model to count and slow down the solves."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, species, Av, Air, rh, obliquity, nlat, **kwargs):
+        with self.lock:
+            self.calls.append(rh)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return run_model(species, Av, Air, rh, obliquity, nlat, **kwargs)
+
+
+run_model = fastrot.run_model
+
+
+async def coalescing():
+    recorder = fastrot.run_model = Recorder(0.2)
+    model = async_fastrot.AsyncModel(executor=ThreadPoolExecutor(4))
+    results = await asyncio.gather(
+        *[model.run_model("H2O", 0.05, 0, 1.5, 90, 41) for i in range(5)]
+    )
+    expected = run_model("H2O", 0.05, 0, 1.5, 90, 41, verbosity=0)
+    check(
+        "identical concurrent calls are coalesced",
+        len(recorder.calls) == 1
+        and all(r == results[0] for r in results)
+        and results[0]["Zbar"] == expected["Zbar"],
+    )
+
+    results[0]["extra"] = True
+    check(
+        "coalesced callers receive copies",
+        all(r is not results[0] and "extra" not in r for r in results[1:]),
+    )
+
+
+async def cancellation():
+    recorder = fastrot.run_model = Recorder(0.3)
+    model = async_fastrot.AsyncModel(executor=ThreadPoolExecutor(4), max_pending=1)
+
+    # the blocker holds the only slot, so the second call waits for it
+    blocker = asyncio.ensure_future(model.run_model("H2O", 0.05, 0, 1.0, 90, 41))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.ensure_future(model.run_model("H2O", 0.05, 0, 2.0, 90, 41))
+    await asyncio.sleep(0.05)
+    waiting.cancel()
+    await asyncio.sleep(0)  # let the waiter cancel the solve
+
+    # the same call again, immediately after the cancellation
+    try:
+        result = await model.run_model("H2O", 0.05, 0, 2.0, 90, 41)
+        passed = result["r_H"] == 2.0
+    except asyncio.CancelledError:
+        passed = False
+    await blocker
+
+    check(
+        "a new call after the last waiter is cancelled starts a new solve",
+        passed and waiting.cancelled() and recorder.calls == [1.0, 2.0],
+    )
+
+
+async def backpressure():
+    recorder = fastrot.run_model = Recorder(0.1)
+    model = async_fastrot.AsyncModel(executor=ThreadPoolExecutor(8), max_pending=2)
+    await asyncio.gather(
+        *[model.run_model("H2O", 0.05, 0, rh, 90, 41) for rh in (1, 2, 3, 4, 5, 6)]
+    )
+    check(
+        f"max_pending limits the solves in progress ({recorder.max_running})",
+        len(recorder.calls) == 6 and recorder.max_running == 2,
+    )
+
+
+async def stream():
+    fastrot.run_model = run_model
+    model = async_fastrot.AsyncModel()
+    params = [(0.05, 0, rh, obl) for rh in (1, 2, 3) for obl in (0, 45, 90)]
+
+    async def aparams():
+        for p in params:
+            yield p
+
+    expected = list(fastrot.run_batch("H2O", *zip(*params), 41))
+    for source in (params, aparams()):
+        results = [
+            r
+            async for r in model.stream("H2O", source, 41, batch_size=2, max_batches=3)
+        ]
+        check(
+            f"stream results are in order ({type(source).__name__})",
+            [(r["Av"], r["Air"], r["r_H"], r["obliquity"]) for r in results] == params
+            and [r["Zbar"] for r in results] == expected,
+        )
+
+
+for test in [coalescing, cancellation, backpressure, stream]:
+    asyncio.run(test())
+fastrot.run_model = run_model
+
+finish()
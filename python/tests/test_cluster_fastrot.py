@@ -0,0 +1,125 @@
+"""Test distributed surveys with local worker processes on loopback."""
+
+import os
+import time
+import socket
+import logging
+import tempfile
+import threading
+import socketserver
+import multiprocessing
+
+from checks import check, finish  # first, puts the scripts on the path
+import fastrot
+import survey_fastrot
+import cluster_fastrot
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def grid_values(path):
+    with survey_fastrot.load_memmap(path)[0] as grid:
+        return list(grid.data)
+
+
+logging.disable(logging.CRITICAL)
+
+axes = [["H2O", "CO"], [0.05, 0.1], [0], [1.0, 2.0, 3.0], [0.0, 45.0, 90.0]]
+nlat = 41
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    reference = os.path.join(tmpdir, "reference.bin")
+    survey_fastrot.survey_memmap(*axes, nlat, reference)
+    expected = grid_values(reference)
+
+    # local worker processes
+    path = os.path.join(tmpdir, "local.bin")
+    t0 = time.monotonic()
+    metadata = cluster_fastrot.coordinate(*axes, nlat, path, chunk_size=4, workers=3)
+    dt = time.monotonic() - t0
+    check(
+        f"three local workers match survey_memmap ({dt:.1f} s)",
+        grid_values(path) == expected and metadata["shape"] == [2, 2, 1, 3, 3],
+    )
+
+    # a lost lease: a task is taken and never returned, then expires and is
+    # completed by a worker that starts later
+    path = os.path.join(tmpdir, "retry.bin")
+    port = free_port()
+    results = {}
+
+    def run():
+        try:
+            results["metadata"] = cluster_fastrot.coordinate(
+                *axes, nlat, path, port=port, chunk_size=4, timeout=1
+            )
+        except Exception as e:
+            results["error"] = e
+
+    coordinator = threading.Thread(target=run)
+    coordinator.start()
+    for i in range(100):
+        try:
+            lost = cluster_fastrot.send("127.0.0.1", port, {"request": "task"})
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    reply = cluster_fastrot.send("127.0.0.1", port, {"result": 10**6, "zbar": [1.0]})
+    check("result for an unknown task is rejected", reply["ok"] is False)
+
+    # 10 tasks, of 4 points each, including the lost one
+    ntasks = cluster_fastrot.worker("127.0.0.1", port)
+    coordinator.join(60)
+    check(
+        "lost lease is handed out again",
+        "task" in lost
+        and ntasks == 10
+        and "error" not in results
+        and grid_values(path) == expected,
+    )
+
+    # transient errors: an empty reply, as when the coordinator fails to
+    # handle a message, then a dropped connection, then the survey is done
+    replies = [b"", None, b'{"done": true}\n']
+
+    class Flaky(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.rfile.readline()
+            reply = replies.pop(0)
+            if reply is not None:
+                self.wfile.write(reply)
+
+    with socketserver.TCPServer(("127.0.0.1", 0), Flaky) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            ntasks = cluster_fastrot.worker(*server.server_address, connect_timeout=10)
+            check("worker retries after transient errors", ntasks == 0 and not replies)
+        except Exception:
+            check("worker retries after transient errors", False)
+        server.shutdown()
+
+    # all local workers die: the coordinator fails instead of waiting forever
+    if multiprocessing.get_start_method() == "fork":
+        path = os.path.join(tmpdir, "dead.bin")
+        run_batch = fastrot.run_batch
+        fastrot.run_batch = lambda *args, **kwargs: os._exit(1)
+        t0 = time.monotonic()
+        try:
+            cluster_fastrot.coordinate(*axes, nlat, path, workers=2, timeout=1)
+            check("coordinator fails when all workers die", False)
+        except RuntimeError:
+            check(
+                "coordinator fails when all workers die",
+                time.monotonic() - t0 < 10,
+            )
+        finally:
+            fastrot.run_batch = run_batch
+    else:
+        print("coordinator fails when all workers die: skipped (requires fork)")
+
+finish()
@@ -0,0 +1,42 @@
+"""Test the limits of large and small thermal inertia of diurnal_fastrot."""
+
+import logging
+
+from checks import check, finish  # first, puts the scripts on the path
+import fastrot
+import diurnal_fastrot
+
+
+logging.disable(logging.WARNING)
+
+species, Av, Air, rh, obliquity, nlat = "H2O", 0.05, 0, 1.5, 30, 41
+period = 12
+
+# large thermal inertia: each latitude is an isotherm, as in fastrot.py
+expected = fastrot.run_model(species, Av, Air, rh, obliquity, nlat, verbosity=0)
+zbar = diurnal_fastrot.run_model(species, Av, Air, rh, obliquity, nlat, 1e5, period)
+d = abs(zbar["Zbar"] / expected["Zbar"] - 1)
+check(f"thermal inertia 1e5 vs. fastrot: difference = {d:.1e}", d < 1e-4)
+
+# small thermal inertia: instantaneous equilibrium with the insolation
+nt = 96
+sin_latitude, delta_sin_latitude = fastrot.latitudes(nlat)
+z = []
+for x in sin_latitude:
+    fracs = diurnal_fastrot.step_insolation(x, obliquity, nt)
+    z.append(
+        sum(
+            fastrot.equilibrium(species, Av, Air, rh, frac, -1)[0]
+            for frac in fracs
+            if frac > 0
+        )
+        / nt
+    )
+expected = fastrot.average(z, delta_sin_latitude)
+zbar = diurnal_fastrot.run_model(
+    species, Av, Air, rh, obliquity, nlat, 0.01, period, nt=nt
+)
+d = abs(zbar["Zbar"] / expected - 1)
+check(f"thermal inertia 0.01 vs. instantaneous equilibrium: difference = {d:.1e}", d < 1e-4)
+
+finish()
@@ -5,6 +5,7 @@ import math
 import json
 import argparse
 import subprocess
+import importlib.util
 
 parser = argparse.ArgumentParser()
 parser.add_argument("script", help="the fastrot script to test")
@@ -15,6 +16,13 @@ parser.add_argument(
     default=0.0006,
     help="relative test tolerance",
 )
+parser.add_argument(
+    "--float32-tol",
+    metavar="tolerance",
+    type=float,
+    default=1e-6,
+    help="relative test tolerance for single-precision results",
+)
 args = parser.parse_args()
 
 RESET = "\033[00m"
@@ -144,3 +152,73 @@ for i in range(len(lines)):
             print(f"{lines[i]}: {FAIL}fail{RESET} (fractional difference = {d})")
     else:
         print(f"{lines[i]}: {FAIL}fail{RESET}")
+
+# single-precision batch results vs. double precision, for the same set of
+# parameters: the calculation is always in double precision, so this only
+# measures the float32 rounding of the output
+spec = importlib.util.spec_from_file_location("fastrot", args.script)
+fastrot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fastrot)
+
+print()
+batches = {}
+for line in lines[1:]:
+    data = line.split()
+    batches.setdefault(data[0], []).append(
+        [float(data[4]), float(data[5]), 10 ** float(data[3]), float(data[1])]
+    )
+
+for species, params in batches.items():
+    z64 = fastrot.run_batch(species, *zip(*params), 41)
+    z32 = fastrot.run_batch(species, *zip(*params), 41, precision="float32")
+    d = max(abs(a - b) / a for a, b in zip(z64, z32))
+    message = f"{species} float32 vs. float64: maximum fractional difference = {d:.2e}"
+    if z32.itemsize == 4 and d < args.float32_tol:
+        print(f"{message}: {OKGREEN}success{RESET}")
+    else:
+        print(f"{message}: {FAIL}fail{RESET}")
+
+# the latitude profiles do not change the results, and integrate back to Zbar
+print()
+for species, obliquity in [("H2O", 30.0), ("CO2", 90.0), ("CO", 0.0)]:
+    a = fastrot.run_model(species, 0.05, 0, 2.0, obliquity, 41, verbosity=0)
+    b = fastrot.run_model(
+        species, 0.05, 0, 2.0, obliquity, 41, verbosity=0, profiles=True
+    )
+    profile = b.pop("profiles")
+    delta_sin_latitude = fastrot.latitudes(41)[1]
+    zbar = fastrot.average(profile["Z"], delta_sin_latitude)
+    message = f"{species} obliquity {obliquity} latitude profiles"
+    if a == b and zbar == b["Zbar"] and profile["niter"].itemsize == 8:
+        print(f"{message}: {OKGREEN}success{RESET}")
+    else:
+        print(f"{message}: {FAIL}fail{RESET}")
+
+
+def reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+# unilluminated latitudes are null in the JSON output
+output = subprocess.check_output(
+    [
+        sys.executable,
+        args.script,
+        "--Av=0.05",
+        "--Air=0",
+        "--rh=2",
+        "--obl=30",
+        "--nlat=41",
+        "--profiles",
+        "H2O",
+    ]
+)
+message = "JSON latitude profiles"
+try:
+    results = json.loads(output, parse_constant=reject_constant)
+    if results["results"]["profiles"]["temperature"][0] is None:
+        print(f"{message}: {OKGREEN}success{RESET}")
+    else:
+        print(f"{message}: {FAIL}fail{RESET}")
+except ValueError:
+    print(f"{message}: {FAIL}fail{RESET} (not standard JSON)")
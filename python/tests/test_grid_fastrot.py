@@ -0,0 +1,75 @@
+"""Test building and querying a precomputed Zbar grid."""
+
+import os
+import math
+import logging
+import tempfile
+from itertools import product
+
+from checks import check, finish  # first, puts the scripts on the path
+import fastrot
+import grid_fastrot
+
+
+logging.disable(logging.WARNING)
+
+Av_set = [0.0, 0.1]
+Air_set = [0.0]
+log_rh_set = [0.0, 0.25, 0.5]
+obl_set = [0.0, 45.0, 90.0]
+nlat = 41
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "zbar.grid")
+    grid_fastrot.build(
+        path,
+        ["H2O", "CO2"],
+        Av_set,
+        Air_set,
+        log_rh_set,
+        obl_set,
+        nlat=nlat,
+        chunk_size=7,
+    )
+    grid = grid_fastrot.ZbarGrid(path)
+
+    # grid nodes reproduce run_batch to single precision in log10(Zbar)
+    for species in ["H2O", "CO2"]:
+        nodes = list(product(Av_set, Air_set, log_rh_set, obl_set))
+        Av, Air, log_rh, obl = zip(*nodes)
+        rh = [10**x for x in log_rh]
+        exact = fastrot.run_batch(species, Av, Air, rh, obl, nlat)
+        interpolated = grid.query(species, Av, Air, rh, obl, fallback=False)
+        d = max(
+            abs(math.log10(a) - math.log10(b)) / abs(math.log10(b))
+            for a, b in zip(interpolated, exact)
+        )
+        check(
+            f"{species} grid nodes: maximum log10(Zbar) difference = {d:.1e}",
+            d <= 2**-23,
+        )
+
+    # points outside of the grid are rejected, or computed exactly
+    outside = ("H2O", [0.05, 0.05, 0.5], 0, [2.0, 5.0, 2.0], 30.0)
+    try:
+        grid.query(*outside, fallback=False)
+        check("points outside of the grid are rejected without fallback", False)
+    except ValueError:
+        check("points outside of the grid are rejected without fallback", True)
+
+    # the first point is inside of the grid, and is interpolated
+    zbar = grid.query(*outside)
+    exact = fastrot.run_batch(*outside, nlat)
+    check(
+        "points outside of the grid fall back to run_batch",
+        zbar[1:] == exact[1:] and zbar[0] == grid.query("H2O", 0.05, 0, 2.0, 30.0)[0],
+    )
+
+    point = ("CO", 0.05, 0, 2.0, 30.0)
+    check(
+        "species outside of the grid fall back to run_batch",
+        grid.query(*point) == fastrot.run_batch(*point, nlat),
+    )
+    grid.close()
+
+finish()
@@ -0,0 +1,65 @@
+"""Test out-of-core surveys and grid file slicing."""
+
+import os
+import logging
+import tempfile
+from itertools import product
+
+from checks import check, finish  # first, puts the scripts on the path
+import fastrot
+import survey_fastrot
+
+
+logging.disable(logging.WARNING)
+
+axes = [["H2O", "CO2"], [0.05, 0.1], [0], [1.0, 2.0, 3.0, 4.0], [0.0, 45.0, 90.0]]
+nlat = 41
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "grid.bin")
+
+    # small chunks, not aligned with the axes
+    metadata = survey_fastrot.survey_memmap(*axes, nlat, path, chunk_size=5)
+    check("survey metadata", metadata["shape"] == [2, 2, 1, 4, 3])
+
+    with survey_fastrot.load_memmap(path)[0] as grid:
+        expected = {}
+        for s, species in enumerate(axes[0]):
+            points = list(product(*axes[1:]))
+            zbar = fastrot.run_batch(species, *zip(*points), nlat)
+            for index, z in zip(product(*[range(len(a)) for a in axes[1:]]), zbar):
+                expected[(s,) + index] = z
+
+        check(
+            "grid points match run_batch",
+            all(grid[index] == z for index, z in expected.items()),
+        )
+
+        # hyperslabs vs. the same points indexed one at a time
+        for key in [
+            (0,),
+            (0, 1, 0, slice(None), 2),
+            (slice(None), 0, 0, slice(None, None, -2), 1),
+            (1, slice(None), 0, -1),
+            (slice(1, None), slice(None), 0, slice(1, 3), slice(None, None, 2)),
+        ]:
+            values, shape = grid.hyperslab(key)
+            full = key + (slice(None),) * (5 - len(key))
+            ranges = [
+                range(len(a))[k] if isinstance(k, slice) else [range(len(a))[k]]
+                for k, a in zip(full, axes)
+            ]
+            check(
+                f"hyperslab {key}",
+                list(values) == [expected[index] for index in product(*ranges)]
+                and shape
+                == tuple(len(r) for r, k in zip(ranges, full) if isinstance(k, slice)),
+            )
+
+        try:
+            grid[0, 0, 0, 4, 0]
+            check("out of bounds index is rejected", False)
+        except IndexError:
+            check("out of bounds index is rejected", True)
+
+finish()
@@ -0,0 +1,72 @@
+"""Test the streaming statistics and sampling of uncertainty_fastrot."""
+
+import math
+import random
+import statistics
+
+from checks import check, finish  # first, puts the scripts on the path
+import uncertainty_fastrot
+
+
+# streaming estimates vs. exact statistics of the same samples
+rng = random.Random(42)
+quantiles = [0.05, 0.16, 0.5, 0.84, 0.95]
+for name, draw in [
+    ("normal", lambda: rng.gauss(3, 2)),
+    ("lognormal", lambda: rng.lognormvariate(0, 1)),
+    ("uniform", lambda: rng.uniform(-1, 1)),
+]:
+    samples = [draw() for i in range(20000)]
+    stats = uncertainty_fastrot.RunningStats(quantiles)
+    for x in samples:
+        stats.add(x)
+    results = stats.results()
+
+    mean = statistics.fmean(samples)
+    std = statistics.stdev(samples)
+    check(
+        f"{name} running mean and standard deviation",
+        math.isclose(results["mean"], mean, rel_tol=1e-9, abs_tol=1e-12)
+        and math.isclose(results["std"], std, rel_tol=1e-9),
+    )
+
+    # P^2 estimates vs. exact quantiles, within a small fraction of the spread
+    samples.sort()
+    d = max(
+        abs(results["quantiles"][str(p)] - samples[round(p * (len(samples) - 1))])
+        for p in quantiles
+    )
+    check(f"{name} P^2 quantiles: maximum difference = {d / std:.3f} sigma", d < 0.02 * std)
+
+# fewer than five samples use the exact quantile
+stats = uncertainty_fastrot.RunningStats([0.5])
+for x in [3, 1, 2]:
+    stats.add(x)
+check("P^2 median of three samples", stats.results()["quantiles"]["0.5"] == 2)
+
+# results for a seed do not depend on the batch size
+spec = (
+    ("normal", 0.05, 0.02, 0, 1),
+    0,
+    ("loguniform", 1, 4),
+    ("uniform", 0, 90),
+)
+a = uncertainty_fastrot.propagate("H2O", *spec, 41, nsamples=50, batch_size=7, seed=1)
+b = uncertainty_fastrot.propagate("H2O", *spec, 41, nsamples=50, batch_size=50, seed=1)
+c = uncertainty_fastrot.propagate("H2O", *spec, 41, nsamples=50, batch_size=50, seed=2)
+check("seed reproducibility across batch sizes", a == b and a["Zbar"] != c["Zbar"])
+
+# distributions that may draw invalid parameters are rejected
+for name, Av, rh, obliquity in [
+    ("untruncated normal Av", ("normal", 0.05, 0.05), 3, 90),
+    ("untruncated normal rh", 0.05, ("normal", 3, 1), 90),
+    ("uniform rh including 0", 0.05, ("uniform", 0, 3), 90),
+    ("untruncated normal obliquity", 0.05, 3, ("normal", 10, 10)),
+]:
+    try:
+        uncertainty_fastrot.propagate("H2O", Av, 0, rh, obliquity, 41, nsamples=10)
+        check(f"{name} is rejected", False)
+    except ValueError:
+        check(f"{name} is rejected", True)
+
+finish()
@@ -0,0 +1,439 @@
+"""
+    Description
+    -----------
+    uncertainty_fastrot.py propagates uncertainties in the input parameters of
+    the main ice sublimation code (fastrot.py) with a Monte Carlo method.
+
+    Samples of the input parameters are drawn in batches from the requested
+    distributions and passed through `fastrot.run_batch`.  The mean, standard
+    deviation, and quantiles of Zbar and Zlog are accumulated with streaming
+    estimators (Welford's algorithm and the P^2 algorithm of Jain & Chlamtac
+    1985, Commun. ACM 28, 1076), so memory use does not depend on the number
+    of samples.
+
+    Distributions are specified as:
+        - a number: the parameter is fixed
+        - ("normal", mean, sigma): normal distribution
+        - ("normal", mean, sigma, lower, upper): normal distribution truncated
+          to [lower, upper]
+        - ("uniform", lower, upper): uniform distribution
+        - ("loguniform", lower, upper): uniform in the logarithm
+
+    On the command line the same specifications are written as, e.g.,
+    `0.05`, `normal:3.2,0.1`, `normal:0.05,0.02,0,1`, or `uniform:0,90`.
+
+    The support of each distribution must be within the valid range of its
+    parameter: 0 <= Av <= 1, 0 <= Air <= 1, rh > 0, and 0 <= obliquity <= 90.
+    Normal distributions must therefore be truncated.
+
+
+    Parameters
+    ----------
+    species : str
+        Ice species to consider: 'H2O', 'H2O-CH4', 'CO2', or 'CO'
+    Av : float or tuple
+        Visual albedo distribution
+    Air : float or tuple
+        Infrared albedo distribution
+    rh : float or tuple
+        Heliocentric distance (in au) distribution
+    obliquity : float or tuple
+        Obliquity distribution
+    nlat : int
+        Number of latitude steps
+
+
+    Returns
+    -------
+    output : dict
+        The keys are:
+            - "species" : str
+            - "nsamples" : int
+            - "seed" : int or None
+            - "Zbar" : dict of "mean", "std", and "quantiles"
+            - "Zlog" : dict of "mean", "std", and "quantiles"
+"""
+import math
+import json
+import random
+import fastrot
+
+distributions = ["normal", "uniform", "loguniform"]
+
+# valid parameter ranges, (lower, upper, lower limit is inclusive)
+valid_ranges = {
+    "Av": (0, 1, True),
+    "Air": (0, 1, True),
+    "rh": (0, math.inf, False),
+    "obliquity": (0, 90, True),
+}
+
+
+class P2Quantile:
+    """Streaming quantile estimate with the P^2 algorithm.
+
+
+    Parameters
+    ----------
+    p : float
+        Quantile to estimate, 0 < p < 1.
+
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        n = self.positions
+
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = int(math.copysign(1, d))
+
+                # parabolic prediction, fall back to linear if not monotonic
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if len(self.heights) == 0:
+            return math.nan
+        if len(self.heights) < 5:
+            return self.heights[round(self.p * (len(self.heights) - 1))]
+        return self.heights[2]
+
+
+class RunningStats:
+    """Streaming mean, standard deviation, and quantiles.
+
+
+    Parameters
+    ----------
+    quantiles : list of float
+        Quantiles to estimate.
+
+    """
+
+    def __init__(self, quantiles):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        # Welford's algorithm
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def results(self):
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+        return {
+            "mean": self.mean,
+            "std": std,
+            "quantiles": {str(q.p): q.value() for q in self.quantiles},
+        }
+
+
+def sampler(spec):
+    """Random number generator for a distribution specification.
+
+
+    Parameters
+    ----------
+    spec : float or tuple
+        Distribution specification, see module documentation.
+
+
+    Returns
+    -------
+    draw : function
+        Called with a `random.Random` instance, returns one sample.
+
+    """
+
+    if isinstance(spec, (int, float)):
+        return lambda rng: spec
+
+    name, *args = spec
+    if name == "normal" and len(args) == 2:
+        mean, sigma = args
+        return lambda rng: rng.gauss(mean, sigma)
+    elif name == "normal" and len(args) == 4:
+        mean, sigma, lower, upper = args
+        if lower >= upper:
+            raise ValueError("Invalid truncation limits.")
+
+        def draw(rng):
+            # rejection sampling
+            while True:
+                x = rng.gauss(mean, sigma)
+                if lower <= x <= upper:
+                    return x
+
+        return draw
+    elif name == "uniform" and len(args) == 2:
+        lower, upper = args
+        return lambda rng: rng.uniform(lower, upper)
+    elif name == "loguniform" and len(args) == 2:
+        lower, upper = math.log(args[0]), math.log(args[1])
+        return lambda rng: math.exp(rng.uniform(lower, upper))
+
+    raise ValueError(f"Invalid distribution: {spec}")
+
+
+def support(spec):
+    """Range of values that may be drawn from a distribution.
+
+
+    Parameters
+    ----------
+    spec : float or tuple
+        Distribution specification, see module documentation.
+
+
+    Returns
+    -------
+    lower, upper : float
+
+    """
+
+    if isinstance(spec, (int, float)):
+        return spec, spec
+
+    name, *args = spec
+    if name == "normal" and len(args) == 2:
+        return -math.inf, math.inf
+    elif name == "normal" and len(args) == 4:
+        return args[2], args[3]
+    elif name in ["uniform", "loguniform"] and len(args) == 2:
+        return args[0], args[1]
+
+    raise ValueError(f"Invalid distribution: {spec}")
+
+
+def check_support(name, spec):
+    """Validate that a distribution only draws valid parameter values.
+
+
+    Raises
+    ------
+    ValueError
+        If the distribution's support is outside of the parameter's valid
+        range.
+
+    """
+
+    lower, upper = support(spec)
+    valid_lower, valid_upper, inclusive = valid_ranges[name]
+    if (
+        lower < valid_lower
+        or (lower == valid_lower and not inclusive)
+        or upper > valid_upper
+    ):
+        valid = "[" if inclusive else "("
+        valid += f"{valid_lower}, {valid_upper}"
+        valid += "]" if math.isfinite(valid_upper) else ")"
+        raise ValueError(
+            f"The {name} distribution {spec} may draw values outside of the valid"
+            f" range {valid}; truncate it or narrow its limits."
+        )
+
+
+def parse_distribution(arg):
+    """Parse a command-line distribution specification, e.g., normal:3.2,0.1"""
+
+    if ":" not in arg:
+        return float(arg)
+
+    name, args = arg.split(":", 1)
+    return (name,) + tuple(float(x) for x in args.split(","))
+
+
+def propagate(
+    species,
+    Av,
+    Air,
+    rh,
+    obliquity,
+    nlat,
+    nsamples=10000,
+    batch_size=1000,
+    seed=None,
+    quantiles=(0.16, 0.5, 0.84),
+):
+    """Monte Carlo uncertainty propagation through `fastrot.run_batch`.
+
+    Parameters are drawn sample by sample, so for a given seed the results do
+    not depend on the batch size.
+
+
+    Parameters
+    ----------
+    species : str
+        Ice species to consider.
+
+    Av, Air, rh, obliquity : float or tuple
+        Parameter distributions, see module documentation.
+
+    nlat : int
+        Number of latitude steps.
+
+    nsamples : int
+        Number of Monte Carlo samples.
+
+    batch_size : int
+        Number of samples evaluated per call to `fastrot.run_batch`.
+
+    seed : int, optional
+        Random number generator seed, for reproducible results.
+
+    quantiles : list of float
+        Quantiles of Zbar and Zlog to estimate.
+
+
+    Returns
+    -------
+    output : dict
+
+    """
+
+    fastrot.check_inputs(species, 0)
+    if nsamples < 1 or batch_size < 1:
+        raise ValueError("nsamples and batch_size must be positive.")
+
+    for name, spec in zip(["Av", "Air", "rh", "obliquity"], [Av, Air, rh, obliquity]):
+        check_support(name, spec)
+
+    rng = random.Random(seed)
+    draws = [sampler(spec) for spec in (Av, Air, rh, obliquity)]
+    stats = {"Zbar": RunningStats(quantiles), "Zlog": RunningStats(quantiles)}
+
+    remaining = nsamples
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        samples = [[draw(rng) for draw in draws] for i in range(n)]
+        for zbar in fastrot.run_batch(species, *zip(*samples), nlat):
+            stats["Zbar"].add(zbar)
+            stats["Zlog"].add(math.log10(zbar))
+        remaining -= n
+
+    return {
+        "species": species,
+        "nsamples": nsamples,
+        "seed": seed,
+        "Zbar": stats["Zbar"].results(),
+        "Zlog": stats["Zlog"].results(),
+    }
+
+
+description = (
+    "Use this program to propagate parameter uncertainties through `fastrot.py`.\n\n"
+    "Distributions are a fixed value (0.05) or one of:\n"
+    "  normal:mean,sigma\n"
+    "  normal:mean,sigma,lower,upper\n"
+    "  uniform:lower,upper\n"
+    "  loguniform:lower,upper"
+)
+
+if __name__ == "__main__":
+    import argparse
+
+    speciesList = ["H2O", "H2O-CH4", "CO2", "CO"]
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("species", choices=speciesList, help="Ice species to consider.")
+    parser.add_argument(
+        "--Av",
+        metavar="visual_albedo",
+        type=parse_distribution,
+        required=True,
+    )
+    parser.add_argument(
+        "--Air",
+        metavar="infrared_albedo",
+        type=parse_distribution,
+        required=True,
+    )
+    parser.add_argument(
+        "--rh",
+        metavar="heliocentric_distance",
+        type=parse_distribution,
+        required=True,
+    )
+    parser.add_argument(
+        "--obl",
+        metavar="obliquity",
+        type=parse_distribution,
+        required=True,
+    )
+    parser.add_argument(
+        "--nlat", metavar="n", type=int, default=181, help="Number of latitude steps"
+    )
+    parser.add_argument(
+        "-n", metavar="n", dest="nsamples", type=int, default=10000, help="Number of samples"
+    )
+    parser.add_argument(
+        "--batch", metavar="n", type=int, default=1000, help="Samples per batch"
+    )
+    parser.add_argument("--seed", type=int, help="Random number generator seed")
+
+    try:
+        args = parser.parse_args()
+        results = {
+            "status": "success",
+            "results": propagate(
+                args.species,
+                args.Av,
+                args.Air,
+                args.rh,
+                args.obl,
+                args.nlat,
+                nsamples=args.nsamples,
+                batch_size=args.batch,
+                seed=args.seed,
+            ),
+        }
+    except Exception as e:
+        results = {"status": "failure", "message": str(e)}
+
+    print(json.dumps(results))